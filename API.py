@@ -1,10 +1,81 @@
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Header, Query, Depends
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
-from predictor import preprocess_and_predict_from_df
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
+import asyncio
+import hmac
+import json
+from datetime import datetime
+from typing import Any, Dict
+from batcher import MicroBatcher
+from executor import BoundedExecutor, ExecutorSaturated
+from ingest import UPLOAD_FORMATS, upload_format, input_schema, read_upload
+from result_cache import ResponseCache, upload_digest
+from result_formats import RESULT_FORMATS, ARROW_FORMATS, negotiate, arrow_available, encode_result
+from predictor import (
+    preprocess_and_predict_from_df, iter_predictions_from_csv, predict_records, validate_record, registry, store,
+    writer, cache, summarize_predictions, PREDICTION_TIERS, DEFAULT_TIER, PREDICTION_LABELS, PASSTHROUGH_COLUMNS
+)
+
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# ضغط الاستجابات بـ gzip للعملاء الذين يرسلون Accept-Encoding: gzip
+# (الاستجابات الأصغر من GZIP_MIN_BYTES تُرسل كما هي)
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+
+# مراقبة ملفات النموذج كل N ثانية (0 لتعطيل المراقبة والاكتفاء بنقطة الإدارة)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "0"))
+# نقاط /admin/* معطلة (403) ما لم يُضبط ADMIN_TOKEN
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# القراءة والتنبؤ والحفظ تعمل في مجموعة خيوط محدودة خارج حلقة الأحداث؛
+# الطلبات الزائدة عن (الخيوط + الطابور) تُرفض فورًا بـ 503
+PREDICT_WORKERS = int(os.getenv("PREDICT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PREDICT_QUEUE_LIMIT = int(os.getenv("PREDICT_QUEUE_LIMIT", "8"))
+RETRY_AFTER_SECONDS = os.getenv("RETRY_AFTER_SECONDS", "2")
+executor = BoundedExecutor(PREDICT_WORKERS, PREDICT_QUEUE_LIMIT)
+
+# الحد الأقصى لعدد الصفوف في صفحة واحدة من /predictions
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
 
-app = FastAPI()
+# طلبات السجل الواحد المتزامنة تُجمع في دفعة واحدة: حتى BATCH_MAX_ROWS سجل أو BATCH_MAX_WAIT_MS،
+# والطلب الذي يتجاوز RECORD_SLO_MS يُرفض بـ 503 بدلاً من الانتظار
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "64"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+RECORD_SLO_MS = float(os.getenv("RECORD_SLO_MS", "250"))
+batcher = MicroBatcher(predict_records, executor, BATCH_MAX_ROWS, BATCH_MAX_WAIT_MS, RECORD_SLO_MS)
+
+# استجابات /predict/ الجاهزة لكل ملف مرفوع (حسب بصمة محتواه): إعادة رفع نفس الملف تكلف حساب البصمة فقط.
+# الحد الأقصى للحجم الكلي بالميغابايت (0 لتعطيلها) ومدة الصلاحية بالثواني
+UPLOAD_CACHE_MB = float(os.getenv("UPLOAD_CACHE_MB", "256"))
+UPLOAD_CACHE_TTL = float(os.getenv("UPLOAD_CACHE_TTL", "3600"))
+uploads = ResponseCache(int(UPLOAD_CACHE_MB * 1024 * 1024), UPLOAD_CACHE_TTL)
+
+@asynccontextmanager
+async def lifespan(app):
+    # تحميل النموذج والمحولات مرة واحدة عند بدء التشغيل
+    registry.load()
+    if MODEL_WATCH_INTERVAL > 0:
+        registry.start_watching(MODEL_WATCH_INTERVAL)
+    writer.start()
+    batcher.start()
+    yield
+    await batcher.stop()
+    registry.stop_watching()
+    executor.shutdown()
+    # كتابة كل النتائج المنتظرة قبل إغلاق قاعدة البيانات
+    writer.stop()
+    store.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -13,32 +84,254 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_BYTES, compresslevel=GZIP_LEVEL)
 
 @app.get("/")
 def home():
     return {"message": "API جاهز لاستقبال البيانات وتحليل الأعطال"}
 
-@app.post("/predict/")
-async def predict(file: UploadFile = File(...)):
-    try:
-        if not file.filename.endswith('.csv'):
-            raise HTTPException(status_code=400, detail="الملف يجب أن يكون بصيغة CSV")
+def saturated_error():
+    return HTTPException(
+        status_code=503,
+        detail="الخادم مشغول حاليًا، يُرجى المحاولة لاحقًا",
+        headers={"Retry-After": RETRY_AFTER_SECONDS}
+    )
 
-        df = pd.read_csv(file.file)
+def run_prediction(upload, filename, tier, output_format="json", prediction_options=None):
+    # تعمل داخل مجموعة الخيوط: قراءة الملف، التنبؤ والحفظ، ثم تحويل النتيجة إلى الصيغة المطلوبة
+    # تثبيت إصدار النموذج لهذا الطلب حتى لو تم تبديله أثناء المعالجة
+    artifacts = registry.get()
+    prediction_options = prediction_options or {}
 
+    # نفس الملف بنفس النموذج والمستوى والخيارات: الاستجابة المحفوظة تُعاد دون قراءة أو تنبؤ
+    digest = upload_digest(upload)
+    upload_key = (digest, artifacts.version, tier)
+    response_key = (*upload_key, output_format, tuple(sorted(prediction_options.items())))
+    cached = uploads.get(response_key) if uploads.enabled else None
+    if cached is not None:
+        content, media_type, headers = cached
+        return Response(content, media_type=media_type, headers=headers)
 
-        if df.empty:
-            raise HTTPException(status_code=400, detail="الملف فارغ")
-            
-        predictions, df_with_results = preprocess_and_predict_from_df(df)
+    # قراءة أعمدة النموذج فقط بأنواعها المضغوطة، مع الأعمدة الإضافية المطلوبة في النتيجة كنصوص
+    df = read_upload(upload, filename, input_schema(artifacts.encoder), PASSTHROUGH_COLUMNS)
 
-        # التحقق من نجاح التنبؤ
-        if predictions is None:
-            raise HTTPException(status_code=500, detail="حدث خطأ أثناء التنبؤ")
-            
-        return {
+    if df.empty:
+        raise HTTPException(status_code=400, detail="الملف فارغ")
+    # upload_key يمنع حفظ نتائج نفس الملف مرة ثانية حتى بعد خروج استجابته من الذاكرة المؤقتة
+    predictions, df_with_results = preprocess_and_predict_from_df(
+        df, artifacts=artifacts, tier=tier, upload=upload_key, **prediction_options
+    )
+
+    # التحقق من نجاح التنبؤ
+    if predictions is None:
+        raise HTTPException(status_code=500, detail="حدث خطأ أثناء التنبؤ")
+
+    # عدد التنبؤات لكل عطل حتى لا يعيد العميل حسابه من النتائج
+    summary = summarize_predictions(predictions)
+
+    if output_format == "json":
+        response = JSONResponse({
             "status": "success",
+            "model_version": artifacts.version,
+            "tier": tier,
+            "summary": summary,
             "results": df_with_results.to_dict(orient="records")
-        }
+        }, headers={"X-Upload-Digest": digest})
+        if uploads.enabled:
+            uploads.put(response_key, response.body, response.media_type, {"X-Upload-Digest": digest})
+        return response
+
+    # الصيغ العمودية: إصدار النموذج والمستوى والملخص في الترويسات كما في /predict/stream/
+    content = encode_result(
+        df_with_results, output_format, status="success", model_version=artifacts.version, tier=tier, summary=summary
+    )
+    headers = {
+        "X-Model-Version": artifacts.version,
+        "X-Prediction-Tier": tier,
+        "X-Prediction-Summary": json.dumps(summary, separators=(",", ":")),
+        "X-Upload-Digest": digest
+    }
+    if uploads.enabled:
+        uploads.put(response_key, content, RESULT_FORMATS[output_format], headers)
+    return Response(content, media_type=RESULT_FORMATS[output_format], headers=headers)
+
+def prediction_options(probabilities: bool = False, top_k: int = Query(0, ge=0, le=len(PREDICTION_LABELS)),
+                       threshold: float = Query(None, ge=0, le=1)):
+    # أعمدة الاحتمالات الاختيارية: كل الفئات، وأعلى top_k فئات، وحد الثقة لـ Uncertain
+    return {"probabilities": probabilities, "top_k": top_k, "threshold": threshold}
+
+@app.post("/predict/")
+async def predict(file: UploadFile = File(...), tier: str = DEFAULT_TIER,
+                  output_format: str = Query(None, alias="format"), accept: str = Header(None),
+                  options: dict = Depends(prediction_options)):
+    try:
+        if tier not in PREDICTION_TIERS:
+            raise HTTPException(status_code=400, detail=f"المستوى يجب أن يكون أحد {PREDICTION_TIERS}")
+
+        if upload_format(file.filename) is None:
+            raise HTTPException(status_code=400, detail=f"الملف يجب أن يكون أحد الصيغ {tuple(UPLOAD_FORMATS)}")
+
+        # ?format= أو ترويسة Accept: json، columns، csv، arrow، parquet
+        output_format = negotiate(accept, output_format)
+        if output_format is None or (output_format in ARROW_FORMATS and not arrow_available()):
+            raise HTTPException(status_code=406, detail=f"الصيغة يجب أن تكون أحد {tuple(RESULT_FORMATS)}")
+
+        return await executor.run(run_prediction, file.file, file.filename, tier, output_format, options)
+    except ExecutorSaturated:
+        raise saturated_error()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"فشل في معالجة الملف: {str(e)}")
+
+@app.post("/predict/record/")
+async def predict_record(record: Dict[str, Any], tier: str = DEFAULT_TIER,
+                         options: dict = Depends(prediction_options)):
+    if tier not in PREDICTION_TIERS:
+        raise HTTPException(status_code=400, detail=f"المستوى يجب أن يكون أحد {PREDICTION_TIERS}")
+    if not record:
+        raise HTTPException(status_code=400, detail="السجل فارغ")
+    # السجل الخاطئ يُرفض هنا وحده قبل أن ينضم إلى دفعة مع طلبات أخرى
+    try:
+        record = validate_record(record)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        result = await batcher.submit(record, tier, options)
+    except (ExecutorSaturated, asyncio.TimeoutError):
+        raise saturated_error()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"فشل في التنبؤ: {str(e)}")
+
+    return {"status": "success", **result}
+
+def encode_next_chunk(chunks, output_format, header):
+    # التنبؤ بالدفعة التالية وتحويلها إلى نص؛ None عند انتهاء الدفعات
+    chunk = next(chunks, None)
+    if chunk is None:
+        return None
+    if output_format == "csv":
+        return chunk.to_csv(index=False, header=header)
+    # pandas >= 2 ينهي lines=True بسطر جديد، والإصدارات الأقدم لا تفعل؛ سطر واحد فقط بين الدفعات
+    text = chunk.to_json(orient="records", lines=True, force_ascii=False)
+    return text if text.endswith("\n") else text + "\n"
+
+async def stream_results(chunks, output_format, release):
+    # كل دفعة تُحسب في مجموعة خيوط التنبؤ (لا في خيوط Starlette) ثم تُرسل فورًا وتُحرر من الذاكرة،
+    # فلا يتجاوز عدد الدفعات المحسوبة في نفس الوقت PREDICT_WORKERS مهما كان عدد الطلبات المتدفقة
+    first = True
+    try:
+        while True:
+            text = await executor.run_reserved(encode_next_chunk, chunks, output_format, first)
+            if text is None:
+                break
+            yield text
+            first = False
+    except Exception as e:
+        # لا يمكن تغيير رمز الحالة بعد بدء الإرسال، لذا يُرسل الخطأ كسطر أخير في NDJSON
+        print(f"فشل التنبؤ المتدفق: {str(e)}")
+        if output_format == "ndjson":
+            yield json.dumps({"status": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+    finally:
+        release()
+
+@app.post("/predict/stream/")
+def predict_stream(file: UploadFile = File(...), tier: str = DEFAULT_TIER,
+                   output_format: str = Query("ndjson", alias="format"), chunksize: int = None,
+                   options: dict = Depends(prediction_options)):
+    if tier not in PREDICTION_TIERS:
+        raise HTTPException(status_code=400, detail=f"المستوى يجب أن يكون أحد {PREDICTION_TIERS}")
+    if output_format not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"الصيغة يجب أن تكون أحد {tuple(STREAM_FORMATS)}")
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(status_code=400, detail="الملف يجب أن يكون بصيغة CSV")
+    if chunksize is not None and chunksize <= 0:
+        raise HTTPException(status_code=400, detail="حجم الدفعة يجب أن يكون أكبر من صفر")
+
+    # كل طلب متدفق يحجز مكانًا في طابور مجموعة الخيوط طوال مدة الإرسال
+    try:
+        release = executor.reserve()
+    except ExecutorSaturated:
+        raise saturated_error()
+
+    # تثبيت إصدار النموذج لكل الدفعات في هذا الطلب
+    artifacts = registry.get()
+    chunks = iter_predictions_from_csv(file.file, artifacts=artifacts, tier=tier, chunksize=chunksize, **options)
+    headers = {"X-Model-Version": artifacts.version, "X-Prediction-Tier": tier}
+    # BackgroundTask تحرر المكان أيضًا إذا لم يبدأ الإرسال أصلًا
+    return StreamingResponse(
+        stream_results(chunks, output_format, release), media_type=STREAM_FORMATS[output_format],
+        headers=headers, background=BackgroundTask(release)
+    )
+
+def fault_code(fault):
+    # يقبل اسم العطل ('Engine Fault') أو رقمه
+    if fault is None:
+        return None
+    codes = {label: code for code, label in PREDICTION_LABELS.items()}
+    if fault in codes:
+        return codes[fault]
+    if fault.lstrip('-').isdigit():
+        return int(fault)
+    raise HTTPException(status_code=400, detail=f"العطل يجب أن يكون أحد {tuple(codes)}")
+
+def timestamp(value):
+    return value.timestamp() if value is not None else None
+
+@app.get("/predictions")
+def list_predictions(start: datetime = None, end: datetime = None, vehicle_id: str = None, fault: str = None,
+                     limit: int = Query(100, ge=1), before_id: int = None):
+    # صفحة من التنبؤات المحفوظة (الأحدث أولًا)؛ next_before_id يُمرر كـ before_id للصفحة التالية
+    limit = min(limit, MAX_PAGE_SIZE)
+    items = store.query(timestamp(start), timestamp(end), vehicle_id, fault_code(fault), limit, before_id)
+    return {
+        "items": items,
+        "next_before_id": items[-1]["id"] if len(items) == limit else None
+    }
+
+@app.get("/predictions/summary")
+def predictions_summary(start: datetime = None, end: datetime = None, vehicle_id: str = None):
+    # عدد التنبؤات لكل عطل، محسوب في SQLite دون تحميل الجدول
+    counts = store.class_counts(timestamp(start), timestamp(end), vehicle_id)
+    return {
+        "total": sum(row["count"] for row in counts),
+        "counts": counts
+    }
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "model_version": registry.version,
+        "executor": executor.stats(),
+        "batcher": batcher.stats(),
+        "writer": writer.stats(),
+        "cache": cache.stats(),
+        "uploads": uploads.stats()
+    }
+
+def check_admin_token(token):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="نقاط الإدارة معطلة: يجب ضبط ADMIN_TOKEN")
+    if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="غير مصرح")
+
+@app.get("/admin/model")
+def model_info(x_admin_token: str = Header(None)):
+    check_admin_token(x_admin_token)
+    artifacts = registry.get()
+    return {
+        "model_version": artifacts.version,
+        "loaded_at": artifacts.loaded_at,
+        "watching": MODEL_WATCH_INTERVAL > 0
+    }
+
+@app.post("/admin/reload")
+def reload_model(background_tasks: BackgroundTasks, force: bool = False, x_admin_token: str = Header(None)):
+    check_admin_token(x_admin_token)
+    # بناء النموذج الجديد في الخلفية ثم تبديله دفعة واحدة
+    background_tasks.add_task(registry.reload, force)
+    return {
+        "status": "reloading",
+        "model_version": registry.version
+    }
@@ -1,7 +1,12 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import gzip
 import os
+import pyarrow as pa
 import plotly.graph_objects as go
 import plotly.express as px
 from plotly.subplots import make_subplots
@@ -10,6 +15,15 @@ import uuid
 
 # تحديد عنوان الـ API (سيتم ضبطه لاحقًا على Railway)
 FASTAPI_URL = os.getenv("FASTAPI_URL", ******")
+ARROW_STREAM_TYPE = "application/vnd.apache.arrow.stream"
+
+# إعدادات الاتصال بالـ API: مهلة الاتصال ومهلة انتظار النتيجة بالثواني، وإعادة المحاولة عند 502/503/504
+# أو انقطاع الاتصال بانتظار متزايد (API_RETRY_BACKOFF × 2^n)، ومستوى ضغط الملف المرسل (0 لإرساله دون ضغط)
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "5"))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "120"))
+API_RETRIES = int(os.getenv("API_RETRIES", "3"))
+API_RETRY_BACKOFF = float(os.getenv("API_RETRY_BACKOFF", "0.5"))
+API_GZIP_LEVEL = int(os.getenv("API_GZIP_LEVEL", "5"))
 
 # Streamlit configuration
 st.set_page_config(
@@ -527,70 +541,164 @@ with col2:
 
 st.markdown('</div>', unsafe_allow_html=True)
 
+@st.cache_resource
+def get_api_session():
+    """
+    جلسة HTTP واحدة مشتركة بين كل عمليات التشغيل: اتصالات keep-alive مع الـ API بدلاً من اتصال TCP/TLS جديد
+    لكل ملف، وإعادة المحاولة بانتظار متزايد (الـ API يحترم Retry-After ويتجاهل حفظ الملف المكرر، فإعادة الإرسال آمنة).
+    """
+    # read=0: انتهاء مهلة القراءة لا يُعاد (الخادم ربما ما زال ينفذ التنبؤ)، فقط أخطاء الاتصال و 502/503/504
+    retry = Retry(
+        total=API_RETRIES,
+        read=0,
+        backoff_factor=API_RETRY_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    return session
+
+def fetch_predictions(uploaded_file):
+    """
+    إرسال الملف إلى الـ API وإرجاع (DataFrame النتائج، رسالة الخطأ).
+    الملف يُرسل مضغوطًا بـ gzip (الـ API يقبل .csv.gz)، والنتيجة تُطلب بصيغة Arrow (أسرع من JSON في التحويل والحجم).
+    """
+    content, filename, content_type = uploaded_file.getvalue(), uploaded_file.name, 'text/csv'
+    if API_GZIP_LEVEL > 0:
+        # mtime=0 يجعل الملف المضغوط ثابتًا لنفس المحتوى، فتبقى بصمته في الـ API واحدة عند إعادة الرفع
+        content = gzip.compress(content, compresslevel=API_GZIP_LEVEL, mtime=0)
+        filename, content_type = f"{filename}.gz", 'application/gzip'
+    files = {'file': (filename, content, content_type)}
+    headers = {'Accept': f'{ARROW_STREAM_TYPE}, application/json;q=0.5'}
+    response = get_api_session().post(
+        FASTAPI_URL, files=files, headers=headers, timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT)
+    )
+
+    # التحقق من استجابة الـ API
+    if response.status_code != 200:
+        return None, f"{response.status_code} - {response.text}"
+    if response.headers.get('content-type', '').startswith(ARROW_STREAM_TYPE):
+        return pa.ipc.open_stream(response.content).read_pandas(), None
+    result = response.json()
+    if result.get("status") == "success":
+        return pd.DataFrame(result["results"]), None
+    return None, result.get('error')
+
+def threshold_line_traces(x, y, threshold, above_color='orangered', below_color='seagreen', width=3):
+    """
+    خط زمني ملون حسب حد: القطعة بين نقطتين متتاليتين بلون above_color إذا تجاوزت إحدى نقطتيها الحد، وإلا below_color.
+    القطع المتتالية بنفس اللون تُجمع في مسار واحد، وكل لون يُرسم كأثر واحد تفصل NaN بين مساراته،
+    فيبقى عدد الآثار اثنين مهما كان عدد النقاط (كل الحساب بـ NumPy دون حلقة على الصفوف).
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    if len(y) < 2:
+        return [go.Scattergl(x=x, y=y, mode='lines', line=dict(color=below_color, width=width), showlegend=False)]
+
+    above = y > threshold
+    hot = above[:-1] | above[1:]
+    # المسار يبدأ عند كل تغير في لون القطعة؛ المسار [start، end) من القطع يغطي النقاط start..end
+    change = np.flatnonzero(hot[1:] != hot[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [len(hot)]))
+
+    traces = []
+    for is_hot, color in ((False, below_color), (True, above_color)):
+        selected = hot[starts] == is_hot
+        run_starts, run_ends = starts[selected], ends[selected]
+        if len(run_starts) == 0:
+            continue
+        # نقاط كل مسار ثم نقطة فاصلة (y = NaN) تقطع الخط قبل المسار التالي
+        sizes = run_ends - run_starts + 2
+        offsets = np.cumsum(sizes) - sizes
+        index = np.repeat(run_starts - offsets, sizes) + np.arange(sizes.sum())
+        gaps = offsets + sizes - 1
+        index[gaps] = run_ends
+        y_values = y[index]
+        y_values[gaps] = np.nan
+        traces.append(go.Scattergl(
+            x=x[index],
+            y=y_values,
+            mode='lines',
+            line=dict(color=color, width=width),
+            connectgaps=False,
+            showlegend=False
+        ))
+    return traces
+
 # التحقق من رفع الملف
+# نتيجة الـ API تُحفظ في الجلسة حسب هوية الملف: تغيير الفلتر أو الرسوم يعيد تشغيل السكربت
+# دون إرسال الملف مرة أخرى، والطلب يُرسل فقط عند رفع ملف جديد
 df = None
 if uploaded_file is not None:
-    with st.spinner("🔄 جاري إرسال الملف ومعالجته عبر API..."):
-        try:
-            # إرسال الملف إلى الـ API
-            files = {'file': (uploaded_file.name, uploaded_file, 'text/csv')}
-            response = requests.post(FASTAPI_URL, files=files)
-
-            # التحقق من استجابة الـ API
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("status") == "success":
-                    df = pd.DataFrame(result["results"])
-                    st.success("✅ تمت المعالجة والتنبؤ بنجاح!")
-                    st.subheader("📋 أنواع الأعطال المحتملة الحدوث")
-
-                    # عرض التنبؤات
-                    fault_types = ['كل الأنواع'] + list(df['Predicted_Fault'].unique())
-                    selected_fault = st.selectbox("اختر نوع العطل لعرضه:", fault_types)
-
-                    if selected_fault != 'كل الأنواع':
-                        filtered_df = df[df['Predicted_Fault'] == selected_fault]
-                    else:
-                        filtered_df = df
-
-                    # عرض النتائج
-                    if not filtered_df.empty:
-                        table_data = []
-                        for idx, row in filtered_df.iterrows():
-                            fault_icon = {
-                                'No Fault': '✅',
-                                'Engine Fault': '⚠️',
-                                'Electrical Fault': '⚠️',
-                                'Emission Fault': '⚠️',
-                                'Transmission Fault': '⚠️'
-                            }.get(row['Predicted_Fault'], '❓')
-
-                            table_data.append({
-                                "Recording": f"{fault_icon} {idx + 1}",
-                                "Possible fault type": row['Predicted_Fault'],
-                                "Attention": row['Prediction_Message'],
-                            })
-
-                        table_df = pd.DataFrame(table_data)
-                        st.dataframe(table_df, use_container_width=True)
-
-                        # زر لتحميل النتائج كملف CSV
-                        csv = table_df.to_csv(index=False)
-                        st.download_button(
-                            label="تحميل النتائج كملف CSV",
-                            data=csv,
-                            file_name="fault_predictions.csv",
-                            mime="text/csv"
-                        )
-                    else:
-                        st.warning("لا توجد نتائج لعرضها.")
+    file_key = (uploaded_file.file_id, uploaded_file.name, uploaded_file.size)
+    cached = st.session_state.get('prediction_result')
+    if cached is not None and cached['file_key'] == file_key:
+        df = cached['df']
+    else:
+        with st.spinner("🔄 جاري إرسال الملف ومعالجته عبر API..."):
+            try:
+                df, error = fetch_predictions(uploaded_file)
+                if df is not None:
+                    st.session_state['prediction_result'] = {'file_key': file_key, 'df': df}
                 else:
-                    st.error(f"❌ حدث خطأ من الخادم: {result.get('error')}")
-            else:
-                st.error(f"❌ حدث خطأ من الخادم: {response.status_code} - {response.text}")
+                    st.error(f"❌ حدث خطأ من الخادم: {error}")
+            except Exception as e:
+                st.error(f"❌ حدث خطأ أثناء إرسال الملف أو المعالجة: {str(e)}")
+else:
+    # إزالة الملف من الواجهة تحرر نتيجته من الجلسة
+    st.session_state.pop('prediction_result', None)
 
-        except Exception as e:
-            st.error(f"❌ حدث خطأ أثناء إرسال الملف أو المعالجة: {str(e)}")
+if df is not None:
+    st.success("✅ تمت المعالجة والتنبؤ بنجاح!")
+    st.subheader("📋 أنواع الأعطال المحتملة الحدوث")
+
+    # عرض التنبؤات
+    fault_types = ['كل الأنواع'] + list(df['Predicted_Fault'].unique())
+    selected_fault = st.selectbox("اختر نوع العطل لعرضه:", fault_types)
+
+    if selected_fault != 'كل الأنواع':
+        filtered_df = df[df['Predicted_Fault'] == selected_fault]
+    else:
+        filtered_df = df
+
+    # عرض النتائج
+    if not filtered_df.empty:
+        table_data = []
+        for idx, row in filtered_df.iterrows():
+            fault_icon = {
+                'No Fault': '✅',
+                'Engine Fault': '⚠️',
+                'Electrical Fault': '⚠️',
+                'Emission Fault': '⚠️',
+                'Transmission Fault': '⚠️'
+            }.get(row['Predicted_Fault'], '❓')
+
+            table_data.append({
+                "Recording": f"{fault_icon} {idx + 1}",
+                "Possible fault type": row['Predicted_Fault'],
+                "Attention": row['Prediction_Message'],
+            })
+
+        table_df = pd.DataFrame(table_data)
+        st.dataframe(table_df, use_container_width=True)
+
+        # زر لتحميل النتائج كملف CSV
+        csv = table_df.to_csv(index=False)
+        st.download_button(
+            label="تحميل النتائج كملف CSV",
+            data=csv,
+            file_name="fault_predictions.csv",
+            mime="text/csv"
+        )
+    else:
+        st.warning("لا توجد نتائج لعرضها.")
 
 
 # معالجة الرسوم البيانية فقط إذا كان df موجودًا
@@ -678,23 +786,7 @@ if df is not None:
 
                         elif chart_name == "2. Line Graph of Engine RPM over time":
                             if 'Engine_RPM' in df.columns and 'Timestamp' in df.columns:
-                                traces = []
-
-                                for i in range(len(df) - 1):
-                                    x_segment = [df["Timestamp"].iloc[i], df["Timestamp"].iloc[i+1]]
-                                    y_segment = [df["Engine_RPM"].iloc[i], df["Engine_RPM"].iloc[i+1]]
-
-                                    color = 'orangered' if y_segment[0] > 6500 or y_segment[1] > 6500 else 'seagreen'
-
-                                    traces.append(go.Scatter(
-                                        x=x_segment,
-                                        y=y_segment,
-                                        mode='lines',
-                                        line=dict(color=color, width=3),
-                                        showlegend=False
-                                    ))
-
-                                fig = go.Figure(data=traces)
+                                fig = go.Figure(data=threshold_line_traces(df["Timestamp"], df["Engine_RPM"], 6500))
                                 fig.update_layout(
                                     title="دورات المحرك عبر الزمن",
                                     xaxis_title="الوقت",
@@ -722,21 +814,9 @@ if df is not None:
                                     day = unique_days[0]  # عرض اليوم الأول فقط
                                     day_data = df[df['Date'] == day].sort_values('Timestamp')
 
-                                    fig = go.Figure()
-
-                                    for i in range(len(day_data) - 1):
-                                        x_segment = [day_data['Timestamp'].iloc[i], day_data['Timestamp'].iloc[i+1]]
-                                        y_segment = [day_data['Coolant_Temp_C'].iloc[i], day_data['Coolant_Temp_C'].iloc[i+1]]
-
-                                        color = 'orangered' if y_segment[0] > 105 or y_segment[1] > 105 else 'seagreen'
-
-                                        fig.add_trace(go.Scatter(
-                                            x=x_segment,
-                                            y=y_segment,
-                                            mode='lines',
-                                            line=dict(color=color, width=3),
-                                            showlegend=False
-                                        ))
+                                    fig = go.Figure(
+                                        data=threshold_line_traces(day_data['Timestamp'], day_data['Coolant_Temp_C'], 105)
+                                    )
 
                                     fig.add_shape(
                                         type='line',
@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+
+class MicroBatcher:
+    """
+    تجميع الطلبات المتزامنة ذات السجل الواحد في دفعة واحدة (حتى max_batch_size سجل أو max_wait_ms)،
+    ثم تشغيل تنبؤ واحد متجه للدفعة وإرجاع نتيجة كل طلب له.
+    """
+
+    def __init__(self, process_batch, executor, max_batch_size=64, max_wait_ms=5.0, slo_ms=100.0):
+        self.process_batch = process_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.slo = slo_ms / 1000
+        self._queue = None
+        self._task = None
+        self._dispatching = set()
+        self._batches = 0
+        self._records = 0
+        self._slo_misses = 0
+        self._max_latency = 0.0
+
+    def start(self):
+        # يجب استدعاؤها داخل حلقة الأحداث (من lifespan)
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # إنهاء الدفعات المعلقة قبل الإيقاف
+        await self._queue.put(None)
+        await self._task
+        if self._dispatching:
+            await asyncio.gather(*self._dispatching, return_exceptions=True)
+        self._task = None
+
+    async def submit(self, record, tier=None, options=None):
+        """
+        إضافة سجل (مع مستواه وخيارات نتيجته) إلى الدفعة التالية وانتظار نتيجته.
+        يرفع asyncio.TimeoutError إذا تجاوز الطلب زمن الـ SLO.
+        """
+        if self._task is None:
+            raise RuntimeError("MicroBatcher is not started")
+        future = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+        await self._queue.put((record, tier, options, future))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.slo)
+        except asyncio.TimeoutError:
+            self._slo_misses += 1
+            raise
+        finally:
+            self._max_latency = max(self._max_latency, time.perf_counter() - start)
+
+    async def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                # إشارة الإيقاف: تُعاد إلى الطابور بعد معالجة هذه الدفعة
+                self._queue.put_nowait(None)
+                break
+            batch.append(item)
+        return batch
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+            batch = await self._collect(first)
+            # التنبؤ يعمل في مجموعة الخيوط بينما يستمر التجميع للدفعة التالية
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatching.add(task)
+            task.add_done_callback(self._dispatching.discard)
+
+    async def _dispatch(self, batch):
+        records = [record for record, _, _, _ in batch]
+        tiers = [tier for _, tier, _, _ in batch]
+        options = [item_options for _, _, item_options, _ in batch]
+        try:
+            results = await self.executor.run(self.process_batch, records, tiers, options)
+        except Exception as e:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self._batches += 1
+        self._records += len(batch)
+        for (_, _, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self._batches,
+            "records": self._records,
+            "avg_batch_size": self._records / self._batches if self._batches else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "slo_ms": self.slo * 1000,
+            "slo_misses": self._slo_misses,
+            "max_latency_ms": self._max_latency * 1000,
+        }
@@ -0,0 +1,133 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import predictor
+from utilize import fill_missing
+
+RAW_CATEGORICAL_VALUES = {
+    'Charging_System_Status': ['Normal', 'Fault'],
+    'EGR_Status': ['Open', 'Closed', 'Stuck_Open'],
+    'Transmission_Gear': ['P', 'R', 'N', 'D', '1', '2', '3', '4', '5', '6'],
+    'Brake_Status': ['Engaged', 'Released'],
+}
+
+
+def _best_time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def synthetic_obd_frame(n_rows, missing_rate=0.05, seed=0):
+    """
+    بيانات OBD عشوائية بنفس أعمدة النموذج الخام مع نسبة من القيم المفقودة.
+    """
+    rng = np.random.default_rng(seed)
+    categorical = set(RAW_CATEGORICAL_VALUES)
+    numeric_cols = [col for col in predictor.registry.get().feature_columns
+                    if not any(col.startswith(f'{cat}_') for cat in categorical)]
+    data = {col: rng.gamma(2.0, 50.0, n_rows) for col in numeric_cols}
+    for col, values in RAW_CATEGORICAL_VALUES.items():
+        data[col] = rng.choice(np.array(values, dtype=object), n_rows)
+    frame = pd.DataFrame(data)
+    for col in frame.columns:
+        frame.loc[rng.random(n_rows) < missing_rate, col] = np.nan
+    return frame
+
+
+def fill_missing_report(n_rows=1_000_000, repeat=3):
+    """
+    مقارنة زمن fill_missing بين المعالجة عمودًا بعمود والوضع batched، مع التحقق من تطابق النتائج.
+    """
+    frame = synthetic_obd_frame(n_rows)
+    per_column = fill_missing(frame.copy(), batched=False)
+    batched = fill_missing(frame.copy(), batched=True)
+    if not per_column.equals(batched):
+        raise AssertionError("batched fill_missing results differ from the per-column results")
+
+    per_column_time = _best_time(lambda: fill_missing(frame.copy(), batched=False), repeat)
+    batched_time = _best_time(lambda: fill_missing(frame.copy(), batched=True), repeat)
+    copy_time = _best_time(lambda: frame.copy(), repeat)
+
+    print(f"fill_missing on {n_rows:,} rows x {frame.shape[1]} columns (including a {copy_time * 1000:.0f} ms copy):")
+    print(f"  per-column: {per_column_time * 1000:.0f} ms")
+    print(f"  batched:    {batched_time * 1000:.0f} ms ({per_column_time / batched_time:.1f}x faster)")
+
+
+def tiers_report(csv_path, label_column=None, repeat=5):
+    """
+    تقرير المقارنة بين مستويات الاستدلال: زمن التنبؤ، ونسبة التطابق مع full و best،
+    والدقة إذا كان الملف يحتوي على عمود التصنيف الحقيقي.
+    """
+    data = pd.read_csv(csv_path)
+    labels = None
+    if label_column:
+        labels = data.pop(label_column)
+        if labels.dtype == object:
+            # يقبل أسماء الأعطال ('Engine Fault' ...) أو أرقام الفئات
+            codes = {name: code for code, name in predictor.PREDICTION_LABELS.items()}
+            labels = labels.map(codes)
+        labels = labels.to_numpy()
+
+    artifacts = predictor.registry.get()
+    prediction_data = predictor.prepare_features(data, artifacts)
+
+    ranges = {tier: predictor.resolve_iteration_range(artifacts, tier) for tier in predictor.PREDICTION_TIERS}
+    reference = {
+        tier: predictor.predict_classes(artifacts, prediction_data, iteration_range)
+        for tier, iteration_range in ranges.items()
+    }
+
+    rows = []
+    for tier, iteration_range in ranges.items():
+        predictions = reference[tier]
+        one_row = prediction_data[:1]
+        batch_time = _best_time(lambda: predictor.predict_classes(artifacts, prediction_data, iteration_range), repeat)
+        row_time = _best_time(lambda: predictor.predict_classes(artifacts, one_row, iteration_range), repeat * 20)
+
+        row = {
+            'tier': tier,
+            'rounds': iteration_range[1] - iteration_range[0],
+            'batch_ms': batch_time * 1000,
+            'single_row_ms': row_time * 1000,
+            'agree_full_%': np.mean(predictions == reference['full']) * 100,
+            'agree_best_%': np.mean(predictions == reference['best']) * 100,
+        }
+        if labels is not None:
+            row['accuracy_%'] = np.mean(predictions == labels) * 100
+        rows.append(row)
+
+    report = pd.DataFrame(rows).set_index('tier')
+    print(f"Tier report for {len(prediction_data)} rows ({csv_path}):")
+    print(report.round(3).to_string())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance reports for the fault prediction pipeline")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    tiers = commands.add_parser('tiers', help="accuracy/latency trade-off per inference tier")
+    tiers.add_argument('csv_path')
+    tiers.add_argument('--label-column', default=None, help="column holding the true class code")
+    tiers.add_argument('--repeat', type=int, default=5)
+
+    fill = commands.add_parser('fill-missing', help="per-column vs batched fill_missing")
+    fill.add_argument('--rows', type=int, default=1_000_000)
+    fill.add_argument('--repeat', type=int, default=3)
+
+    args = parser.parse_args()
+    if args.command == 'tiers':
+        tiers_report(args.csv_path, args.label_column, args.repeat)
+    elif args.command == 'fill-missing':
+        fill_missing_report(args.rows, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExecutorSaturated(Exception):
+    """
+    يُرفع عندما تكون كل الخيوط مشغولة والطابور ممتلئًا.
+    """
+
+
+class BoundedExecutor:
+    """
+    مجموعة خيوط محدودة الحجم مع طابور محدود، لتشغيل المهام الثقيلة (القراءة والتنبؤ والحفظ)
+    خارج حلقة asyncio. عند امتلاء الطابور تُرفض المهمة فورًا بدلاً من تراكمها.
+    """
+
+    def __init__(self, max_workers, queue_limit, name='predict'):
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + queue_limit)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+
+    def reserve(self):
+        """
+        حجز مكان لمهمة واحدة؛ يرفع ExecutorSaturated إذا لم يوجد مكان.
+        تُعيد دالة تحرير يمكن استدعاؤها أكثر من مرة بأمان.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise ExecutorSaturated("كل الخيوط مشغولة والطابور ممتلئ")
+        with self._lock:
+            self._in_flight += 1
+
+        released = threading.Event()
+
+        def release(*_):
+            with self._lock:
+                if released.is_set():
+                    return
+                released.set()
+                self._in_flight -= 1
+            self._slots.release()
+
+        return release
+
+    def submit(self, fn, *args, **kwargs):
+        release = self.reserve()
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            release()
+            raise
+        future.add_done_callback(release)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        تشغيل الدالة في مجموعة الخيوط وانتظار نتيجتها دون حجز حلقة الأحداث.
+        """
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    async def run_reserved(self, fn, *args, **kwargs):
+        """
+        مثل run لكن لمهمة حجزت مكانها مسبقًا بـ reserve (مثل الطلب المتدفق الذي يرسل دفعات متتالية):
+        لا يُحجز مكان جديد، لكن العمل يجري في نفس الخيوط فلا يتجاوز العمل المتزامن max_workers.
+        """
+        return await asyncio.wrap_future(self._pool.submit(fn, *args, **kwargs))
+
+    def stats(self):
+        with self._lock:
+            in_flight, rejected = self._in_flight, self._rejected
+        return {
+            "workers": self.max_workers,
+            "queue_limit": self.queue_limit,
+            "running": min(in_flight, self.max_workers),
+            "queued": max(in_flight - self.max_workers, 0),
+            "rejected": rejected,
+        }
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+
+class CompiledEncoder:
+    """
+    تحويل محولات encoders.pkl إلى جداول بحث مرة واحدة، ثم بناء مصفوفة الخصائص (float32)
+    مباشرة بترتيب feature_columns.pkl دون استدعاء LabelEncoder/OneHotEncoder أو إنشاء DataFrame وسيطة.
+    القيم غير المعروفة تُعامل كما في encode_categorical_columns: تُستبدل بأول فئة.
+    """
+
+    def __init__(self, encoders, feature_columns):
+        self.feature_columns = list(feature_columns)
+        self.n_features = len(self.feature_columns)
+        position = {col: i for i, col in enumerate(self.feature_columns)}
+
+        # الأعمدة الثنائية (LabelEncoder): الرمز هو ترتيب القيمة في classes_
+        self.label_columns = []
+        for col, encoder in encoders.items():
+            if col in ('onehot_encoder', 'onehot_columns'):
+                continue
+            if col in position:
+                self.label_columns.append((col, pd.Index(encoder.classes_), position[col]))
+
+        # الأعمدة متعددة القيم (OneHotEncoder): لكل فئة رقم عمودها في المصفوفة أو -1 إذا حُذفت أو لم تُستخدم
+        self.onehot_columns = []
+        onehot_encoder = encoders.get('onehot_encoder')
+        multi_cols = encoders.get('onehot_columns', [])
+        if onehot_encoder is not None:
+            drop_idx = getattr(onehot_encoder, 'drop_idx_', None)
+            for i, col in enumerate(multi_cols):
+                categories = onehot_encoder.categories_[i]
+                dropped = drop_idx[i] if drop_idx is not None else None
+                targets = np.full(len(categories) + 1, -1, dtype=np.intp)
+                for code, category in enumerate(categories):
+                    if dropped is not None and code == dropped:
+                        continue
+                    targets[code] = position.get(f'{col}_{category}', -1)
+                # القيمة غير المعروفة (الرمز -1) تُعامل كأول فئة
+                targets[-1] = targets[0]
+                self.onehot_columns.append((col, pd.Index(categories), targets))
+
+        # الأعمدة الرقمية تُنسخ كما هي
+        encoded = {col for col, _, _ in self.label_columns}
+        for col, categories, _ in self.onehot_columns:
+            encoded.update(f'{col}_{category}' for category in categories)
+        self.numeric_columns = [(col, i) for i, col in enumerate(self.feature_columns) if col not in encoded]
+
+        # الأعمدة الخام التي تُقرأ من البيانات المرفوعة
+        self.input_columns = (
+            [col for col, _ in self.numeric_columns]
+            + [col for col, _, _ in self.label_columns]
+            + [col for col, _, _ in self.onehot_columns]
+        )
+
+    @staticmethod
+    def _codes(values, categories, fill_value=None):
+        # رموز Categorical متجهة: -1 للقيم غير الموجودة في الفئات أو المفقودة
+        codes = pd.Categorical(values, categories=categories).codes
+        if fill_value is not None:
+            # القيم المفقودة تأخذ رمز قيمة الملء (نفس نتيجة fillna قبل الترميز)
+            fill_code = categories.get_loc(fill_value) if fill_value in categories else -1
+            if fill_code >= 0:
+                codes = np.where(values.isna().to_numpy(), fill_code, codes)
+        return codes
+
+    def transform(self, data, fill_values=None):
+        """
+        إرجاع مصفوفة float32 بحجم (عدد الصفوف × عدد الخصائص) بنفس ترتيب feature_columns.
+        تُقرأ الأعمدة من data مباشرة دون نسخها أو تعديلها، وتُملأ القيم المفقودة من fill_values
+        داخل المصفوفة نفسها. الأعمدة غير الموجودة في البيانات تبقى أصفارًا.
+        """
+        fill_values = fill_values or {}
+        n_rows = len(data)
+        matrix = np.zeros((n_rows, self.n_features), dtype=np.float32)
+
+        for col, i in self.numeric_columns:
+            if col in data.columns:
+                column = matrix[:, i]
+                column[:] = data[col].to_numpy(dtype=np.float32, na_value=np.nan)
+                fill_value = fill_values.get(col)
+                if fill_value is not None and not pd.isna(fill_value):
+                    column[np.isnan(column)] = fill_value
+
+        for col, classes, i in self.label_columns:
+            if col in data.columns:
+                codes = self._codes(data[col], classes, fill_values.get(col))
+                matrix[:, i] = np.where(codes < 0, 0, codes)
+
+        rows = np.arange(n_rows)
+        for col, categories, targets in self.onehot_columns:
+            if col not in data.columns:
+                continue
+            target = targets[self._codes(data[col], categories, fill_values.get(col))]
+            hit = target >= 0
+            matrix[rows[hit], target[hit]] = 1.0
+
+        return matrix
@@ -0,0 +1,162 @@
+import io
+from collections import defaultdict
+
+import pandas as pd
+
+# امتدادات الملفات المقبولة في /predict/: (نوع الملف، الضغط)
+UPLOAD_FORMATS = {
+    '.csv': ('csv', None),
+    '.csv.gz': ('csv', 'gzip'),
+    '.csv.gzip': ('csv', 'gzip'),
+    '.csv.zst': ('csv', 'zstd'),
+    '.csv.zstd': ('csv', 'zstd'),
+    '.parquet': ('parquet', None),
+    '.arrow': ('arrow', None),
+    '.feather': ('arrow', None),
+    '.ipc': ('arrow', None),
+}
+
+# حجم الجزء الذي يُقرأ للعثور على سطر العناوين في CSV
+HEADER_BLOCK_SIZE = 65536
+
+
+def upload_format(filename):
+    """
+    نوع الملف المرفوع وضغطه من امتداده، أو None إذا لم يكن مدعومًا.
+    """
+    name = (filename or '').lower()
+    for suffix in sorted(UPLOAD_FORMATS, key=len, reverse=True):
+        if name.endswith(suffix):
+            return UPLOAD_FORMATS[suffix]
+    return None
+
+
+def input_schema(encoder):
+    """
+    أنواع الأعمدة الخام التي يقرأها النموذج: الأعمدة الرقمية من feature_columns.pkl كـ float64 حتى تُعاد
+    وتُحفظ بقيمها كما رُفعت (التحويل إلى float32 في مصفوفة الخصائص فقط)، والأعمدة الفئوية من encoders.pkl
+    كـ category بقيم نصية حتى تطابق فئات المحولات (مثل '1' في Transmission_Gear).
+    """
+    schema = {col: 'float64' for col, _ in encoder.numeric_columns}
+    schema.update({col: 'category' for col, _, _ in encoder.label_columns})
+    schema.update({col: 'category' for col, _, _ in encoder.onehot_columns})
+    return schema
+
+
+def parse_passthrough(value):
+    """
+    الأعمدة الإضافية (خارج أعمدة النموذج) التي تُقرأ كنصوص وتُعاد في النتيجة:
+    'all' كلها، و 'none' أو '' لا شيء، أو قائمة مفصولة بفواصل مثل 'Timestamp,VIN'.
+    تُعيد None لكل الأعمدة أو قائمة بالأسماء.
+    """
+    value = (value or '').strip()
+    if value.lower() == 'all':
+        return None
+    if value.lower() in ('', 'none'):
+        return []
+    return [col.strip() for col in value.split(',') if col.strip()]
+
+
+def _keep(col, schema, passthrough):
+    return col in schema or passthrough is None or col in passthrough
+
+
+def _arrow_type(dtype):
+    import pyarrow as pa
+    return {
+        'float64': pa.float64(),
+        'float32': pa.float32(),
+        'str': pa.string(),
+        'category': pa.dictionary(pa.int32(), pa.string()),
+    }[dtype]
+
+
+def _csv_header(buffer, compression):
+    # قراءة أسماء الأعمدة فقط (بعد فك الضغط إن وُجد)
+    import pyarrow as pa
+    stream = pa.input_stream(buffer, compression=compression)
+    head = b''
+    while b'\n' not in head:
+        block = stream.read(HEADER_BLOCK_SIZE)
+        if not block:
+            break
+        head += block
+    line = head.split(b'\n', 1)[0].decode('utf-8-sig').rstrip('\r')
+    return pd.read_csv(io.StringIO(line), nrows=0).columns.tolist()
+
+
+def _read_csv_arrow(source, compression, schema, passthrough):
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    # الملف (مضغوطًا) يُقرأ إلى الذاكرة مرة واحدة ليُقرأ منه سطر العناوين ثم الجدول
+    buffer = pa.py_buffer(source.read())
+    # أنواع صريحة لكل الأعمدة: أعمدة النموذج حسب المخطط والأعمدة الإضافية نصوص كما هي،
+    # والأعمدة غير المطلوبة لا تُحوّل أصلًا
+    columns = [col for col in _csv_header(buffer, compression) if _keep(col, schema, passthrough)]
+    column_types = {col: _arrow_type(schema.get(col, 'str')) for col in columns}
+    table = pv.read_csv(
+        pa.input_stream(buffer, compression=compression),
+        convert_options=pv.ConvertOptions(
+            column_types=column_types, include_columns=columns, strings_can_be_null=True
+        )
+    )
+    return table.to_pandas()
+
+
+def _apply_schema(df, schema):
+    # ملفات Parquet/Arrow تحمل أنواعها؛ تُحوّل أعمدة النموذج فقط إذا اختلف نوعها
+    for col, dtype in schema.items():
+        if col in df.columns and str(df[col].dtype) != dtype:
+            if dtype == 'category':
+                # الفئات نصية دائمًا لتطابق فئات المحولات
+                df[col] = df[col].astype('str').where(df[col].notna()).astype('category')
+            else:
+                df[col] = df[col].astype(dtype)
+    return df
+
+
+def _selected_columns(names, schema, passthrough):
+    return [col for col in names if _keep(col, schema, passthrough)]
+
+
+def read_upload(source, filename, schema, passthrough=None):
+    """
+    قراءة الملف المرفوع (CSV مضغوط أو لا، Parquet، Arrow IPC) إلى DataFrame بأنواع المخطط.
+    تُقرأ أعمدة النموذج بأنواعها المضغوطة، والأعمدة الإضافية في passthrough (None لكلها) كما هي
+    لتُعاد مع النتائج، وتُتجاهل بقية الأعمدة دون تحليلها.
+    CSV يُقرأ بمحرك pyarrow إن وُجد، وإلا بمحرك pandas مع نفس الأنواع.
+    """
+    kind, compression = upload_format(filename)
+
+    if kind == 'parquet':
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(source)
+        columns = _selected_columns(parquet.schema_arrow.names, schema, passthrough)
+        return _apply_schema(parquet.read(columns=columns).to_pandas(), schema)
+
+    if kind == 'arrow':
+        import pyarrow as pa
+        try:
+            table = pa.ipc.open_file(source).read_all()
+        except pa.ArrowInvalid:
+            # Arrow IPC بصيغة stream بدلاً من file
+            source.seek(0)
+            table = pa.ipc.open_stream(source).read_all()
+        table = table.select(_selected_columns(table.column_names, schema, passthrough))
+        return _apply_schema(table.to_pandas(), schema)
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return read_csv_pandas(source, schema, passthrough, compression=compression)
+    return _read_csv_arrow(source, compression, schema, passthrough)
+
+
+def read_csv_pandas(source, schema, passthrough=None, **kwargs):
+    """
+    نفس المخطط وتقليم الأعمدة بمحرك pandas (يُستخدم أيضًا للقراءة على دفعات بـ chunksize).
+    """
+    return pd.read_csv(
+        source, dtype=defaultdict(lambda: 'str', schema),
+        usecols=lambda col: _keep(col, schema, passthrough), **kwargs
+    )
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+
+import joblib
+
+from feature_encoder import CompiledEncoder
+from tree_engine import CompiledForest
+
+# مجموعة ثابتة من الملفات المحملة، تُشارك بين كل الطلبات دون نسخ.
+# عند إعادة التحميل تُنشأ مجموعة جديدة بالكامل ولا تُعدّل القديمة أبدًا.
+# model هو XGBClassifier و forest هو المحرك المترجم إلى NumPy؛ أحدهما قد يكون None بحسب backend.
+# imputer قاموس قيم الملء المحفوظة من التدريب، أو None إذا لم يوجد الملف.
+# encoder جداول البحث المترجمة من encoders.pkl لبناء مصفوفة الخصائص مباشرة.
+ModelArtifacts = namedtuple('ModelArtifacts', [
+    'model', 'encoders', 'feature_columns', 'version', 'loaded_at', 'forest', 'n_rounds', 'best_iteration',
+    'imputer', 'encoder'
+])
+
+BACKENDS = ('xgboost', 'numpy', 'auto')
+
+
+class ModelRegistry:
+    """
+    تحميل النموذج والمحولات وأعمدة الخصائص مرة واحدة لكل عملية ومشاركتها بين الخيوط،
+    مع إمكانية إعادة تحميلها في الخلفية دون إيقاف الـ API.
+    """
+
+    def __init__(self, model_path, encoders_path, feature_columns_path, backend='xgboost', imputer_path=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {BACKENDS}")
+        self.backend = backend
+        self.model_path = model_path
+        self.encoders_path = encoders_path
+        self.feature_columns_path = feature_columns_path
+        self.imputer_path = imputer_path
+        self._artifacts = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self._watch_stop = None
+        self._watch_thread = None
+
+    @property
+    def paths(self):
+        paths = (self.model_path, self.encoders_path, self.feature_columns_path)
+        # ملف قيم الملء اختياري ويدخل في الإصدار فقط عند وجوده
+        if self._has_imputer():
+            paths += (self.imputer_path,)
+        return paths
+
+    def _has_imputer(self):
+        return bool(self.imputer_path) and os.path.exists(self.imputer_path)
+
+    def _file_signature(self):
+        # تغيّر وقت التعديل أو الحجم (أو إضافة ملف قيم الملء) يعني أن الملفات استُبدلت
+        return tuple((p, os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in self.paths)
+
+    def _compute_version(self):
+        digest = hashlib.sha256()
+        for path in self.paths:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        return digest.hexdigest()[:12]
+
+    def _load_artifacts(self):
+        signature = self._file_signature()
+        version = self._compute_version()
+        model = self._load_xgboost() if self.backend != 'numpy' else None
+        forest = self._load_forest()
+        encoders = joblib.load(self.encoders_path)
+        feature_columns = list(joblib.load(self.feature_columns_path))
+        imputer = joblib.load(self.imputer_path) if self._has_imputer() else None
+        encoder = CompiledEncoder(encoders, feature_columns)
+        if forest is not None:
+            n_rounds, best_iteration = forest.n_rounds, forest.best_iteration
+        else:
+            n_rounds = model.get_booster().num_boosted_rounds()
+            best_iteration = getattr(model, 'best_iteration', None)
+        artifacts = ModelArtifacts(
+            model, encoders, feature_columns, version, time.time(), forest, n_rounds, best_iteration,
+            imputer, encoder
+        )
+        return artifacts, signature
+
+    def _load_xgboost(self):
+        # استيراد xgboost عند الحاجة فقط حتى لا يدفع backend='numpy' تكلفة استيراده
+        import xgboost as xgb
+        model = xgb.XGBClassifier()
+        model.load_model(self.model_path)
+        return model
+
+    def _load_forest(self):
+        if self.backend == 'xgboost':
+            return None
+        try:
+            return CompiledForest(self.model_path)
+        except ValueError as e:
+            if self.backend == 'numpy':
+                raise
+            # في وضع auto نكتفي بـ xgboost إذا احتوى النموذج على ما لا يدعمه المحرك
+            print(f"تعذر ترجمة النموذج إلى NumPy، سيتم استخدام xgboost فقط: {str(e)}")
+            return None
+
+    def load(self):
+        """
+        تحميل الملفات من القرص (يُستدعى عند بدء تشغيل الـ API).
+        """
+        with self._lock:
+            if self._artifacts is None:
+                print("جاري تحميل النموذج والمحولات...")
+                self._artifacts, self._signature = self._load_artifacts()
+                print(f"تم تحميل النموذج، الإصدار: {self._artifacts.version}")
+            return self._artifacts
+
+    def get(self):
+        """
+        إرجاع الملفات المحملة، مع تحميلها عند أول استدعاء إذا لم تُحمّل بعد.
+        """
+        artifacts = self._artifacts
+        if artifacts is None:
+            artifacts = self.load()
+        return artifacts
+
+    def reload(self, force=False):
+        """
+        بناء نسخة جديدة من الملفات ثم استبدالها دفعة واحدة.
+        الطلبات الجارية تكمل على النسخة القديمة التي أخذتها عبر get().
+        تُعيد True إذا تغيّر الإصدار.
+        """
+        with self._lock:
+            if not force and self._signature is not None and self._file_signature() == self._signature:
+                return False
+
+            current = self._artifacts
+            try:
+                artifacts, signature = self._load_artifacts()
+            except Exception as e:
+                # الإبقاء على النسخة الحالية إذا كانت الملفات الجديدة غير صالحة
+                print(f"فشل في إعادة تحميل النموذج، سيستمر استخدام الإصدار الحالي: {str(e)}")
+                return False
+
+            self._signature = signature
+            if current is not None and artifacts.version == current.version:
+                return False
+
+            self._artifacts = artifacts
+            old_version = current.version if current is not None else None
+            print(f"تم تبديل النموذج: {old_version} -> {artifacts.version}")
+            return True
+
+    def start_watching(self, interval=30.0):
+        """
+        مراقبة الملفات في خيط خلفي وإعادة تحميلها عند تغيّرها.
+        """
+        if self._watch_thread is not None:
+            return
+
+        self._watch_stop = threading.Event()
+
+        def watch():
+            while not self._watch_stop.wait(interval):
+                try:
+                    self.reload()
+                except OSError as e:
+                    # قد تكون الملفات قيد الاستبدال في هذه اللحظة
+                    print(f"تعذر فحص ملفات النموذج: {str(e)}")
+
+        self._watch_thread = threading.Thread(target=watch, name='model-watcher', daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        if self._watch_thread is None:
+            return
+        self._watch_stop.set()
+        self._watch_thread.join()
+        self._watch_thread = None
+        self._watch_stop = None
+
+    @property
+    def is_loaded(self):
+        return self._artifacts is not None
+
+    @property
+    def version(self):
+        artifacts = self._artifacts
+        return artifacts.version if artifacts is not None else None
@@ -1,16 +1,50 @@
+from itertools import chain
+import numpy as np
 import pandas as pd
-import xgboost as xgb
-import joblib
-import sqlite3
 import os
-from utilize import fill_missing, encode_categorical_columns
+from utilize import compute_fill_values
+from ingest import input_schema, parse_passthrough, read_csv_pandas
+from model_registry import ModelRegistry
+from result_cache import PredictionCache, row_keys
+from storage import PredictionBatch, PredictionStore, WriteBehindQueue
 
 MODEL_PATH = "car_fault_classifier.json"
 ENCODERS_PATH = "encoders.pkl"
 FEATURE_COLUMNS_PATH = "feature_columns.pkl"
+# قيم الملء المحسوبة من بيانات التدريب (utilize.fit_imputer)؛ اختياري
+IMPUTER_PATH = "imputer.pkl"
 DB_PATH = "OBD_Predictions.db"
 TABLE_NAME = "fault_predictions"
 
+# محرك الاستدلال: xgboost، أو numpy (المحرك المترجم)، أو auto (numpy للدفعات الصغيرة و xgboost للكبيرة)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "auto")
+NUMPY_BACKEND_MAX_ROWS = int(os.getenv("NUMPY_BACKEND_MAX_ROWS", "64"))
+
+# مستويات الاستدلال: full كل الجولات، best حتى best_iteration (الافتراضي)،
+# fast عدد أقل من الجولات للطلبات الحساسة للزمن مع فرق دقة معروف (انظر benchmark.py tiers)
+PREDICTION_TIERS = ('full', 'best', 'fast')
+DEFAULT_TIER = os.getenv("PREDICTION_TIER", "best")
+FAST_TIER_ROUNDS = int(os.getenv("FAST_TIER_ROUNDS", "20"))
+
+# عدد الصفوف في كل دفعة عند التنبؤ المتدفق للملفات الكبيرة
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "50000"))
+
+# الأعمدة الإضافية في الملفات المرفوعة التي تُعاد مع النتائج: all، أو none، أو قائمة مثل Timestamp,VIN
+# (الأعمدة غير المذكورة لا تُقرأ أصلًا)
+PASSTHROUGH_COLUMNS = parse_passthrough(os.getenv("PASSTHROUGH_COLUMNS", "all"))
+
+# ذاكرة مؤقتة لهوامش التنبؤ لكل صف خصائص مكرر (قراءات متطابقة أو ملفات مرفوعة مرة أخرى):
+# الحد الأقصى لعدد الصفوف (0 لتعطيلها) ومدة الصلاحية بالثواني، وأكبر دفعة تستخدمها
+# (الدفعات الأكبر، مثل الملفات الكبيرة، تذهب إلى النموذج مباشرة دون كلفة البحث والحفظ)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "100000"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+RESULT_CACHE_MAX_BATCH_ROWS = int(os.getenv("RESULT_CACHE_MAX_BATCH_ROWS", "1000"))
+cache = PredictionCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_MAX_BATCH_ROWS)
+
+# يُحمّل النموذج والمحولات مرة واحدة ويُعاد استخدامها في كل الطلبات
+registry = ModelRegistry(
+    MODEL_PATH, ENCODERS_PATH, FEATURE_COLUMNS_PATH, backend=INFERENCE_BACKEND, imputer_path=IMPUTER_PATH
+)
 
 PREDICTION_LABELS = {
     3: 'No Fault',
@@ -20,8 +54,7 @@ PREDICTION_LABELS = {
     4: 'Transmission Fault'
 }
 
-def get_prediction_message(prediction):
-    messages = {
+PREDICTION_MESSAGES = {
     0: "⚠️❗⚡ تحذير ❗: تم رصد احتمال حدوث خلل كهربائي قريبًا. يُوصى بالتحقق من الأنظمة الكهربائية. يمكنك استشارة المساعد الذكي عن الحلول الممكنة.",
     1: "⚠️❗🌫️ انتباه❗: هناك مؤشرات على احتمالية وجود مشكلة في نظام الانبعاثات. يمكنك استشارة المساعد الذكي عن الحلول الممكنة.",
     2: "⚠️❗🔧 تحذير❗: تم رصد احتمال وجود خلل في أجزاء من المحرك. يُفضل إجراء فحص فوري. يمكنك استشارة المساعد الذكي عن الحلول الممكنة.",
@@ -29,54 +62,206 @@ def get_prediction_message(prediction):
     4: "⚠️❗⚙️ انتباه عاجل❗: احتمال بحدوث خلل في ناقل الحركة خلال دقائق. يمكنك استشارة المساعد الذكي عن الحلول الممكنة."
 }
 
-    return messages.get(prediction, "❗ نوع العطل غير معروف، يُرجى المراجعة.")
+def get_prediction_message(prediction):
+    return PREDICTION_MESSAGES.get(prediction, "❗ نوع العطل غير معروف، يُرجى المراجعة.")
+
+# التنبؤ الذي تقل ثقته (أعلى احتمال) عن هذا الحد يُعرض "غير مؤكد" (0 لتعطيله)
+UNCERTAIN_THRESHOLD = float(os.getenv("UNCERTAIN_THRESHOLD", "0"))
+UNCERTAIN_LABEL = 'Uncertain'
+UNCERTAIN_MESSAGE = "❔ النموذج غير متأكد من هذه القراءة، يُفضل مراجعتها أو إعادة القياس. يمكنك استشارة المساعد الذكي عن الحلول الممكنة."
+
+# أسماء الأعطال ورسائلها مرتبة حسب رمز الفئة، ثم Uncertain في الرمز التالي،
+# لتحويل مصفوفة التنبؤات دفعة واحدة إلى أعمدة category (رمز صغير لكل صف بدلاً من نص)
+FAULT_LABELS = np.array([PREDICTION_LABELS.get(code, 'Unknown Fault') for code in range(len(PREDICTION_LABELS))], dtype=object)
+FAULT_MESSAGES = np.array([get_prediction_message(code) for code in range(len(PREDICTION_LABELS))], dtype=object)
+UNCERTAIN_CODE = len(FAULT_LABELS)
+RESULT_LABELS = pd.Index(list(FAULT_LABELS) + [UNCERTAIN_LABEL])
+RESULT_MESSAGES = pd.Index(list(FAULT_MESSAGES) + [UNCERTAIN_MESSAGE])
+
+# حفظ قراءات الحساسات (أعمدة النموذج فقط) مع كل تنبؤ؛ 0 للاكتفاء بالوقت ورقم المركبة ورمز العطل
+STORE_INPUTS = os.getenv("STORE_INPUTS", "1") == "1"
+# حفظ احتمالات كل الفئات مع كل تنبؤ (الثقة تُحفظ دائمًا)
+STORE_PROBABILITIES = os.getenv("STORE_PROBABILITIES", "0") == "1"
+
+# اتصال واحد بقاعدة البيانات (WAL) مشترك بين كل الطلبات؛ الرسائل تُحفظ مرة واحدة في جدول بحث
+store = PredictionStore(
+    DB_PATH, TABLE_NAME, messages={code: (label, get_prediction_message(code)) for code, label in PREDICTION_LABELS.items()}
+)
+
+# الحفظ في الخلفية عند تشغيل writer (من الـ API): حد أقصى للصفوف المنتظرة، ثم الكتابة كل N صف أو كل T ثانية
+WRITE_QUEUE_MAX_ROWS = int(os.getenv("WRITE_QUEUE_MAX_ROWS", "200000"))
+WRITE_FLUSH_ROWS = int(os.getenv("WRITE_FLUSH_ROWS", "5000"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "1.0"))
+writer = WriteBehindQueue(store, WRITE_QUEUE_MAX_ROWS, WRITE_FLUSH_ROWS, WRITE_FLUSH_INTERVAL)
+
+def resolve_iteration_range(artifacts, tier=None, iteration_range=None):
+    """
+    تحويل مستوى الاستدلال (أو نطاق صريح) إلى نطاق جولات التعزيز المستخدمة في التنبؤ.
+    """
+    if iteration_range is not None:
+        begin, end = iteration_range
+        if not 0 <= begin < end <= artifacts.n_rounds:
+            raise ValueError(f"نطاق التكرارات غير صالح: ({begin}, {end})")
+        return (begin, end)
+
+    tier = tier or DEFAULT_TIER
+    best_rounds = artifacts.n_rounds if artifacts.best_iteration is None else artifacts.best_iteration + 1
+    if tier == 'full':
+        return (0, artifacts.n_rounds)
+    if tier == 'best':
+        return (0, best_rounds)
+    if tier == 'fast':
+        return (0, max(1, min(FAST_TIER_ROUNDS, best_rounds)))
+    raise ValueError(f"tier must be one of {PREDICTION_TIERS}")
+
+def predict_classes(artifacts, prediction_data, iteration_range=None):
+    """
+    اختيار محرك الاستدلال المناسب لحجم الدفعة (النتائج متطابقة في الحالتين).
+    """
+    if iteration_range is None:
+        iteration_range = resolve_iteration_range(artifacts)
+    if artifacts.forest is not None and (artifacts.model is None or len(prediction_data) <= NUMPY_BACKEND_MAX_ROWS):
+        return artifacts.forest.predict(prediction_data, iteration_range=iteration_range)
+    return artifacts.model.predict(prediction_data, iteration_range=iteration_range)
+
+def predict_margins(artifacts, prediction_data, iteration_range=None):
+    """
+    الهوامش الخام لكل فئة (output_margin) بنفس اختيار المحرك في predict_classes.
+    منها تُشتق الفئة (argmax، مطابقة لـ predict) والاحتمالات (softmax) دون تمرير ثانٍ على الأشجار.
+    """
+    if iteration_range is None:
+        iteration_range = resolve_iteration_range(artifacts)
+    if artifacts.forest is not None and (artifacts.model is None or len(prediction_data) <= NUMPY_BACKEND_MAX_ROWS):
+        return artifacts.forest.predict_margin(prediction_data, iteration_range=iteration_range)
+    return artifacts.model.predict(prediction_data, output_margin=True, iteration_range=iteration_range)
+
+def predict_margins_cached(artifacts, prediction_data, iteration_range=None):
+    """
+    مثل predict_margins، لكن الصفوف الموجودة في الذاكرة المؤقتة لا تمر على النموذج:
+    فقط الصفوف الناقصة (بدون تكرار) تُرسل دفعة واحدة إلى المحرك ثم تُحفظ.
+    """
+    if len(prediction_data) == 0 or not cache.accepts(len(prediction_data)):
+        return predict_margins(artifacts, prediction_data, iteration_range)
+    if iteration_range is None:
+        iteration_range = resolve_iteration_range(artifacts)
+
+    n_classes = len(FAULT_LABELS)
+    keys = row_keys(prediction_data)
+    margins, missing = cache.lookup(artifacts.version, iteration_range, keys, n_classes)
+    if missing:
+        groups = list(missing.values())
+        computed = predict_margins(artifacts, prediction_data[[rows[0] for rows in groups]], iteration_range)
+        # نسخ هامش كل صف محسوب إلى كل الصفوف المطابقة له في الطلب
+        sizes = [len(rows) for rows in groups]
+        margins[np.fromiter(chain.from_iterable(groups), dtype=np.intp, count=sum(sizes))] = np.repeat(computed, sizes, axis=0)
+        cache.store(artifacts.version, iteration_range, list(missing), computed)
+    return margins
+
+def class_probabilities(margins):
+    shifted = np.exp(margins - margins.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+def add_prediction_columns(data, predictions, probabilities, include_probabilities=False, top_k=0,
+                           threshold=None):
+    """
+    إضافة أعمدة النتيجة إلى data من مصفوفتي الفئات والاحتمالات مباشرة (دون حلقة على الصفوف):
+    Predicted_Fault و Prediction_Message دائمًا، و Confidence مع أي خيار إضافي،
+    و Probability_<العطل> لكل فئة، و Top_<i>_Fault / Top_<i>_Probability لأعلى top_k فئات.
+    الصفوف التي تقل ثقتها عن threshold تُعرض Uncertain (رمز الفئة المحفوظ لا يتغير).
+    """
+    threshold = UNCERTAIN_THRESHOLD if threshold is None else threshold
+    confidence = probabilities.max(axis=1)
+
+    codes = np.asarray(predictions, dtype=np.int8)
+    if threshold > 0:
+        codes = np.where(confidence < threshold, np.int8(UNCERTAIN_CODE), codes)
+    data['Predicted_Fault'] = pd.Categorical.from_codes(codes, categories=RESULT_LABELS)
+    data['Prediction_Message'] = pd.Categorical.from_codes(codes, categories=RESULT_MESSAGES)
+
+    if include_probabilities or top_k or threshold > 0:
+        data['Confidence'] = confidence
+    if include_probabilities:
+        for code, label in enumerate(FAULT_LABELS):
+            data[f"Probability_{label.replace(' ', '_')}"] = probabilities[:, code]
+    if top_k:
+        ranked = np.argsort(-probabilities, axis=1, kind='stable')[:, :top_k]
+        ranked_probabilities = np.take_along_axis(probabilities, ranked, axis=1)
+        for i in range(ranked.shape[1]):
+            data[f'Top_{i + 1}_Fault'] = pd.Categorical.from_codes(ranked[:, i], categories=RESULT_LABELS)
+            data[f'Top_{i + 1}_Probability'] = ranked_probabilities[:, i]
+    return data
+
+def summarize_predictions(predictions):
+    """
+    عدد التنبؤات لكل عطل (np.bincount) بنفس شكل /predictions/summary.
+    """
+    counts = np.bincount(np.asarray(predictions, dtype=np.intp), minlength=len(FAULT_LABELS))
+    return {
+        "total": int(counts.sum()),
+        "counts": [
+            {"fault_code": code, "label": FAULT_LABELS[code], "count": int(count)}
+            for code, count in enumerate(counts)
+        ]
+    }
+
+def prepare_features(data, artifacts):
+    """
+    ملء القيم المفقودة وترميز الأعمدة الفئوية، وإرجاع مصفوفة float32 بترتيب الأعمدة الذي يتوقعه النموذج.
+    البيانات الأصلية لا تُنسخ ولا تُعدّل: القيم المفقودة تُملأ داخل المصفوفة مباشرة.
+    """
+    if artifacts.imputer is not None:
+        # قيم ثابتة من التدريب: لا تعتمد على حجم الدفعة وتعمل مع صف واحد
+        fill_values = artifacts.imputer
+    else:
+        # نفس قواعد fill_missing، محسوبة فقط للأعمدة المستخدمة التي تحتوي على قيم مفقودة
+        missing_cols = [col for col in artifacts.encoder.input_columns if col in data.columns and data[col].hasnans]
+        fill_values = compute_fill_values(data, missing_cols, strategy_numeric='auto')
+
+    # الترميز عبر جداول البحث المترجمة؛ الأعمدة غير الموجودة تبقى أصفارًا
+    return artifacts.encoder.transform(data, fill_values)
 
 # Prediction and processing function
-def preprocess_and_predict_from_df(original_data):
+def preprocess_and_predict_from_df(original_data, artifacts=None, tier=None, iteration_range=None, upload=None,
+                                   probabilities=False, top_k=0, threshold=None):
     """
     تستقبل DataFrame من Streamlit وتعيد النتائج بعد المعالجة والتنبؤ.
+    يمكن تمرير artifacts لتثبيت إصدار النموذج المستخدم في هذا الطلب،
+    و tier أو iteration_range لتحديد عدد جولات التعزيز المستخدمة،
+    و probabilities و top_k و threshold لأعمدة الاحتمالات (انظر add_prediction_columns)،
+    و upload مفتاح الملف المرفوع حتى لا تُحفظ نتائج نفس الملف مرتين (انظر PredictionBatch).
     """
     try:
-        data = original_data.copy()
-        print(f"جاري معالجة {len(data)} صف من البيانات...")
+        print(f"جاري معالجة {len(original_data)} صف من البيانات...")
+
+        # نسخة واحدة من الملفات المحملة طوال هذا الطلب
+        if artifacts is None:
+            artifacts = registry.get()
 
         # خطوات المعالجة
-        data = fill_missing(data, strategy_numeric='auto', save_indicators=False)
-        encoded_data, _ = encode_categorical_columns(data, encoders_path=ENCODERS_PATH)
-
-        # تحميل الأعمدة المطلوبة
-        expected_columns = joblib.load(FEATURE_COLUMNS_PATH)
-        for col in expected_columns:
-            if col not in encoded_data.columns:
-                encoded_data[col] = 0
-        prediction_data = encoded_data[expected_columns]
-
-        # تحميل النموذج
-        print("جاري تحميل النموذج وإجراء التنبؤ...")
-        model = xgb.XGBClassifier()
-        model.load_model(MODEL_PATH)
-
-        predictions = model.predict(prediction_data)
+        prediction_data = prepare_features(original_data, artifacts)
+
+        iteration_range = resolve_iteration_range(artifacts, tier, iteration_range)
+        print(f"جاري إجراء التنبؤ باستخدام الجولات {iteration_range}...")
+        # تمرير واحد على الأشجار: الفئة والاحتمالات من نفس الهوامش
+        margins = predict_margins_cached(artifacts, prediction_data, iteration_range)
+        predictions = margins.argmax(axis=1).astype(np.int32)
+        class_probs = class_probabilities(margins)
         print(f"تم الانتهاء من التنبؤ. عدد التنبؤات: {len(predictions)}")
 
         # إضافة النتائج إلى البيانات الأصلية
-        original_data['Predicted_Fault'] = [PREDICTION_LABELS.get(p, 'Unknown Fault') for p in predictions]
-        original_data['Prediction_Message'] = [get_prediction_message(p) for p in predictions]
+        add_prediction_columns(original_data, predictions, class_probs, probabilities, top_k, threshold)
 
         # Save the predictions to database
         print("جاري حفظ النتائج في قاعدة البيانات...")
-        save_to_database(original_data)
+        save_to_database(original_data, predictions, artifacts, class_probs, upload)
         print("تم حفظ النتائج بنجاح.")
         
         # إحصائيات سريعة
-        fault_counts = {}
-        for p in predictions:
-            fault_name = PREDICTION_LABELS.get(p, 'Unknown')
-            fault_counts[fault_name] = fault_counts.get(fault_name, 0) + 1
-        
+        summary = summarize_predictions(predictions)
         print("\nملخص نتائج التنبؤ:")
-        for fault, count in fault_counts.items():
-            print(f"- {fault}: {count} ({count/len(predictions)*100:.1f}%)")
+        for row in summary["counts"]:
+            if row["count"]:
+                print(f"- {row['label']}: {row['count']} ({row['count']/summary['total']*100:.1f}%)")
         
         return predictions, original_data
 
@@ -86,8 +271,104 @@ def preprocess_and_predict_from_df(original_data):
         traceback.print_exc()  
         return None, None
 
+def iter_predictions_from_csv(source, artifacts=None, tier=None, chunksize=None, **prediction_options):
+    """
+    قراءة ملف CSV على دفعات وتشغيل المعالجة والتنبؤ والحفظ لكل دفعة،
+    مع إرجاع كل دفعة بعد إضافة النتائج إليها حتى يبقى استهلاك الذاكرة محدودًا مهما كان حجم الملف.
+    ملاحظة: بدون imputer.pkl تُحسب قيم الملء من كل دفعة على حدة.
+    """
+    if artifacts is None:
+        artifacts = registry.get()
+
+    schema = input_schema(artifacts.encoder)
+    for chunk in read_csv_pandas(source, schema, PASSTHROUGH_COLUMNS, chunksize=chunksize or STREAM_CHUNK_ROWS):
+        predictions, chunk_with_results = preprocess_and_predict_from_df(
+            chunk, artifacts=artifacts, tier=tier, **prediction_options
+        )
+        if predictions is None:
+            raise RuntimeError("حدث خطأ أثناء التنبؤ")
+        yield chunk_with_results
+
+def validate_record(record, artifacts=None):
+    """
+    التحقق من سجل مفرد قبل ضمه إلى دفعة MicroBatcher، حتى لا يُفشل سجل خاطئ طلبات الآخرين في نفس الدفعة.
+    تُعيد السجل بقيم رقمية float في الأعمدة الرقمية، وترفع ValueError إذا لم يحتوِ أي عمود من أعمدة النموذج
+    أو إذا كانت قيمة عمود رقمي غير رقمية أو كانت أي قيمة قائمة/كائنًا.
+    """
+    if artifacts is None:
+        artifacts = registry.get()
+    encoder = artifacts.encoder
+
+    if not any(col in record for col in encoder.input_columns):
+        raise ValueError("السجل لا يحتوي على أي عمود من أعمدة النموذج")
+
+    numeric = {col for col, _ in encoder.numeric_columns}
+    cleaned = {}
+    for col, value in record.items():
+        if isinstance(value, (list, dict)):
+            raise ValueError(f"قيمة العمود {col} يجب أن تكون قيمة مفردة")
+        if col in numeric and value is not None:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"قيمة العمود {col} يجب أن تكون رقمية")
+        cleaned[col] = value
+    return cleaned
+
+def predict_records(records, tiers=None, options=None, artifacts=None):
+    """
+    تنبؤ متجه لمجموعة سجلات مفردة جمعها MicroBatcher من طلبات مختلفة،
+    وإرجاع نتيجة كل سجل بنفس ترتيبه. يمكن أن يختلف المستوى من سجل لآخر،
+    وكذلك خيارات الاحتمالات (probabilities و top_k و threshold كما في add_prediction_columns).
+    """
+    if artifacts is None:
+        artifacts = registry.get()
+    tiers = tiers or [None] * len(records)
+    options = options or [None] * len(records)
+
+    data = pd.DataFrame.from_records(records)
+    # السجلات تُتحقق منها في validate_record؛ هنا أي قيمة غير رقمية متبقية تصبح NaN بدلاً من إفشال الدفعة كلها
+    for col, _ in artifacts.encoder.numeric_columns:
+        if col in data.columns:
+            data[col] = pd.to_numeric(data[col], errors='coerce')
+    # قيم الملء لا تُحسب من الدفعة لأنها تجمع سجلات من طلبات مستقلة؛
+    # بدون imputer.pkl تبقى القيم الرقمية المفقودة NaN ويتبع النموذج الاتجاه الافتراضي لكل عقدة
+    prediction_data = artifacts.encoder.transform(data, artifacts.imputer)
+
+    margins = np.empty((len(records), len(FAULT_LABELS)), dtype=np.float32)
+    for tier in set(tiers):
+        rows = [i for i, t in enumerate(tiers) if t == tier]
+        iteration_range = resolve_iteration_range(artifacts, tier)
+        margins[rows] = predict_margins_cached(artifacts, prediction_data[rows], iteration_range)
+
+    predictions = margins.argmax(axis=1).astype(np.int32)
+    class_probs = class_probabilities(margins)
+    save_to_database(data, predictions, artifacts, class_probs)
+
+    # أعمدة النتيجة تُبنى مرة لكل مجموعة سجلات بنفس الخيارات
+    results = [None] * len(records)
+    groups = {}
+    for i, record_options in enumerate(options):
+        groups.setdefault(tuple(sorted((record_options or {}).items())), []).append(i)
+    for key, rows in groups.items():
+        record_options = dict(key)
+        columns = add_prediction_columns(
+            pd.DataFrame(index=range(len(rows))), predictions[rows], class_probs[rows],
+            record_options.get('probabilities', False), record_options.get('top_k', 0), record_options.get('threshold')
+        )
+        for i, values in zip(rows, columns.to_dict(orient='records')):
+            results[i] = {"model_version": artifacts.version, "tier": tiers[i] or DEFAULT_TIER, **values}
+    return results
+
 # SQLite
-def save_to_database(df):
-    conn = sqlite3.connect(DB_PATH)
-    df.to_sql(TABLE_NAME, conn, if_exists='append', index=False)
-    conn.close()
\ No newline at end of file
+def save_to_database(df, predictions, artifacts, probabilities=None, upload=None):
+    # يُحفظ رمز العطل فقط (الاسم والرسالة في جدول البحث)، مع المدخلات إذا كان STORE_INPUTS مفعّلًا
+    batch = PredictionBatch(
+        df, predictions, probabilities, input_schema(artifacts.encoder) if STORE_INPUTS else None,
+        store_probabilities=STORE_PROBABILITIES, upload=upload
+    )
+    # بدون writer يعمل (سكربت أو Streamlit مباشرة) تُكتب الدفعة فورًا
+    if writer.running:
+        writer.put(batch)
+    else:
+        store.write(batch)
\ No newline at end of file
@@ -0,0 +1,212 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def row_keys(matrix):
+    """
+    مفتاح لكل صف في مصفوفة الخصائص: بايتات الصف نفسه (float32 × عدد الخصائص)،
+    فالمفتاح يطابق الصف تمامًا دون احتمال تصادم، و dict يحسب تجزئته.
+    """
+    matrix = np.ascontiguousarray(matrix)
+    return matrix.view(np.dtype((np.void, matrix.shape[1] * matrix.itemsize))).ravel().tolist()
+
+
+def upload_digest(source, block_size=1 << 20):
+    """
+    بصمة SHA-256 لمحتوى الملف المرفوع كما هو (قبل فك الضغط)، ثم إعادة المؤشر إلى بدايته للقراءة.
+    """
+    digest = hashlib.sha256()
+    for block in iter(lambda: source.read(block_size), b''):
+        digest.update(block)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    ذاكرة LRU مؤقتة لهوامش التنبؤ لكل صف خصائص مُرمّز، مع مدة صلاحية (TTL) لكل مدخل.
+    المفاتيح مقيدة بإصدار النموذج ونطاق الجولات، وتُمسح كلها عند ظهور إصدار جديد.
+    الدفعات الأكبر من max_batch_rows لا تستخدم الذاكرة أصلًا (الصفوف فيها غالبًا فريدة، وقد تملأ الذاكرة
+    ثم تُخرج ما حفظته للتو)، والقفل يُؤخذ لكل lock_step صف فقط حتى لا تنتظر طلبات السجل الواحد دفعة كبيرة.
+    """
+
+    def __init__(self, max_entries=100000, ttl=3600.0, max_batch_rows=1000, lock_step=256):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_batch_rows = max_batch_rows
+        self.lock_step = lock_step
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._bypassed = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def accepts(self, rows):
+        """
+        هل تستخدم دفعة بهذا العدد من الصفوف الذاكرة المؤقتة.
+        """
+        if not self.enabled:
+            return False
+        if rows > self.max_batch_rows:
+            with self._lock:
+                self._bypassed += 1
+            return False
+        return True
+
+    def _check_version(self, version):
+        # إصدار جديد من النموذج: كل الهوامش المحفوظة لم تعد صالحة
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def lookup(self, version, namespace, keys, n_classes):
+        """
+        تُعيد (مصفوفة الهوامش للصفوف الموجودة، قاموس {مفتاح: أرقام الصفوف الناقصة}).
+        الصفوف المكررة داخل الطلب نفسه تظهر مرة واحدة في الناقصة.
+        """
+        cache_keys = [(namespace, key) for key in keys]
+        found = []
+        now = time.monotonic()
+        # تحت القفل فقط قراءة المدخلات وتحديث ترتيب LRU، على أجزاء صغيرة
+        for start in range(0, len(cache_keys), self.lock_step):
+            with self._lock:
+                self._check_version(version)
+                entries = self._entries
+                for key in cache_keys[start:start + self.lock_step]:
+                    entry = entries.get(key)
+                    if entry is not None and entry[1] > now:
+                        entries.move_to_end(key)
+                        found.append(entry[0])
+                    else:
+                        found.append(None)
+
+        margins = np.empty((len(keys), n_classes), dtype=np.float32)
+        missing = {}
+        hit_rows, hit_values = [], []
+        for i, (key, value) in enumerate(zip(keys, found)):
+            if value is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                hit_rows.append(i)
+                hit_values.append(value)
+        if hit_rows:
+            margins[hit_rows] = hit_values
+        with self._lock:
+            self._hits += len(hit_rows)
+            self._misses += len(keys) - len(hit_rows)
+        return margins, missing
+
+    def store(self, version, namespace, keys, margins):
+        expires_at = time.monotonic() + self.ttl
+        # قيم Python مستقلة لكل صف حتى لا تبقى مصفوفة الدفعة كاملة في الذاكرة
+        items = [((namespace, key), (row, expires_at)) for key, row in zip(keys, np.asarray(margins, dtype=np.float32).tolist())]
+        for start in range(0, len(items), self.lock_step):
+            with self._lock:
+                self._check_version(version)
+                self._entries.update(items[start:start + self.lock_step])
+        self._trim()
+
+    def _trim(self):
+        # إخراج الأقدم على خطوات محدودة، مع تحرير القفل بين كل خطوة
+        while True:
+            with self._lock:
+                entries = self._entries
+                excess = min(len(entries) - self.max_entries, self.lock_step)
+                if excess <= 0:
+                    return
+                for _ in range(excess):
+                    entries.popitem(last=False)
+                self._evictions += excess
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "max_batch_rows": self.max_batch_rows,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "bypassed_batches": self._bypassed,
+            }
+
+
+class ResponseCache:
+    """
+    ذاكرة LRU مؤقتة لاستجابات /predict/ الجاهزة (المحتوى ونوعه وترويساته)، محدودة بالحجم الكلي بالبايت
+    وبمدة صلاحية لكل مدخل. المفتاح يتضمن بصمة الملف وإصدار النموذج، فإصدار جديد لا يطابق المدخلات القديمة.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=3600.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _remove(self, key):
+        content = self._entries.pop(key)[0][0]
+        self._bytes -= len(content)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, content, media_type, headers):
+        # استجابة أكبر من الحد كله لا تُحفظ حتى لا تُخرج كل ما سواها
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = ((content, media_type, headers), time.monotonic() + self.ttl)
+            self._bytes += len(content)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+            }
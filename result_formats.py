@@ -0,0 +1,113 @@
+import json
+
+# صيغ نتيجة /predict/: json (قائمة سجلات، الافتراضية)، columns (JSON عمودي مضغوط)، csv، arrow، parquet
+RESULT_FORMATS = {
+    "json": "application/json",
+    "columns": "application/json",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# أنواع Accept المقبولة لكل صيغة (columns تُطلب بـ ?format=columns فقط لأنها تشارك نوع JSON)
+ACCEPT_TYPES = {
+    "application/json": "json",
+    "text/csv": "csv",
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+}
+
+# الصيغ الثنائية تحتاج pyarrow
+ARROW_FORMATS = ("arrow", "parquet")
+
+
+def negotiate(accept=None, requested=None):
+    """
+    اختيار صيغة النتيجة: ?format= أولًا، ثم ترويسة Accept حسب قيم q، ثم json.
+    تُعيد None فقط إذا كانت صيغة ?format= غير مدعومة؛ أنواع Accept غير المدعومة (مثل text/html)
+    أو صيغ Arrow بلا pyarrow تُهمل ويُرجع json.
+    """
+    if requested:
+        return requested if requested in RESULT_FORMATS else None
+    if not accept:
+        return "json"
+
+    binary = arrow_available()
+    candidates = []
+    for position, item in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality <= 0:
+            continue
+        if media_type in ACCEPT_TYPES and (binary or ACCEPT_TYPES[media_type] not in ARROW_FORMATS):
+            candidates.append((-quality, position, ACCEPT_TYPES[media_type]))
+        elif media_type in ("*/*", "application/*"):
+            candidates.append((-quality, position, "json"))
+    return min(candidates)[2] if candidates else "json"
+
+
+def arrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _arrow_table(df):
+    import pyarrow as pa
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def to_arrow_ipc(df):
+    import pyarrow as pa
+    table = _arrow_table(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def to_parquet(df):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    sink = pa.BufferOutputStream()
+    pq.write_table(_arrow_table(df), sink)
+    return sink.getvalue().to_pybytes()
+
+
+def to_columns_json(df, **meta):
+    """
+    JSON عمودي: {"columns": {"اسم العمود": [القيم ...]}} مع بيانات الطلب (status، model_version ...).
+    كل عمود يُحوّل مرة واحدة بـ to_json دون إنشاء قاموس لكل صف، وأسماء الأعمدة لا تتكرر.
+    """
+    columns = ",".join(
+        json.dumps(str(col), ensure_ascii=False) + ":"
+        + df[col].to_json(orient="values", force_ascii=False, date_format="iso", double_precision=15)
+        for col in df.columns
+    )
+    head = json.dumps(meta, ensure_ascii=False)[:-1]
+    separator = ", " if meta else ""
+    return f'{head}{separator}"columns": {{{columns}}}}}'.encode("utf-8")
+
+
+def encode_result(df, output_format, **meta):
+    """
+    تحويل DataFrame النتائج إلى محتوى الاستجابة للصيغة المختارة (عدا json التي تبقى قائمة سجلات).
+    """
+    if output_format == "columns":
+        return to_columns_json(df, **meta)
+    if output_format == "csv":
+        return df.to_csv(index=False).encode("utf-8")
+    if output_format == "arrow":
+        return to_arrow_ipc(df)
+    if output_format == "parquet":
+        return to_parquet(df)
+    raise ValueError(f"صيغة غير مدعومة: {output_format}")
@@ -0,0 +1,492 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+# إعدادات SQLite للكتابة المتكررة: WAL يسمح بالقراءة أثناء الكتابة، و synchronous=NORMAL آمن مع WAL
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA busy_timeout=5000",
+)
+
+# أعمدة البيانات المرفوعة التي تُحفظ مع كل تنبؤ لتعريف القراءة
+TIMESTAMP_COLUMN = 'Timestamp'
+VEHICLE_COLUMN = 'VIN'
+
+# أعمدة الجدول القديم (to_sql) التي لا تُنقل كمدخلات عند الترحيل
+LEGACY_RESULT_COLUMNS = ('Predicted_Fault', 'Prediction_Message')
+
+
+def _sql_type(dtype):
+    # نفس الأنواع التي كان يستخدمها to_sql عند إنشاء الجدول
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _column_values(series):
+    # قيم Python أصلية (NaN تُحفظ NULL)
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        series = series.dt.strftime('%Y-%m-%d %H:%M:%S')
+    elif not pd.api.types.is_numeric_dtype(series.dtype):
+        return [None if pd.isna(v) else str(v) for v in series.tolist()]
+    return series.tolist()
+
+
+class PredictionBatch:
+    """
+    نتائج دفعة واحدة للحفظ: البيانات المرفوعة، ورموز الأعطال، واحتمالات الفئات (اختيارية؛ تُحفظ منها الثقة،
+    وكل الاحتمالات إذا كان store_probabilities)، وأعمدة المدخلات التي تُحفظ مع كل تنبؤ بأنواعها
+    ({العمود: النوع} من ingest.input_schema، أو None لعدم حفظها).
+    upload مفتاح الملف المرفوع (البصمة، إصدار النموذج، المستوى): الدفعة لا تُحفظ إذا حُفظ نفس المفتاح من قبل.
+    """
+
+    __slots__ = (
+        'data', 'fault_codes', 'probabilities', 'input_schema', 'store_probabilities', 'upload', 'predicted_at'
+    )
+
+    def __init__(self, data, fault_codes, probabilities=None, input_schema=None, store_probabilities=True,
+                 upload=None):
+        self.data = data
+        self.fault_codes = np.asarray(fault_codes)
+        self.probabilities = probabilities
+        self.input_schema = input_schema
+        self.store_probabilities = store_probabilities
+        self.upload = upload
+        self.predicted_at = time.time()
+
+    def __len__(self):
+        return len(self.fault_codes)
+
+
+class PredictionStore:
+    """
+    اتصال واحد طويل العمر بقاعدة البيانات (وضع WAL) لحفظ نتائج التنبؤ في مخطط مضغوط:
+    - fault_messages: جدول بحث لاسم العطل ورسالته لكل رمز (بدلاً من تكرار الرسالة في كل صف).
+    - fault_predictions: صف صغير لكل تنبؤ (الوقت، رقم المركبة، رمز العطل، الثقة والاحتمالات اختياريًا).
+    - prediction_inputs: قراءات الحساسات بأنواعها (REAL/TEXT)، مرتبطة برقم التنبؤ، إذا كان حفظ المدخلات مفعّلًا.
+    - prediction_uploads: بصمة كل ملف مرفوع حُفظت نتائجه، مع أول رقم تنبؤ وعدد الصفوف، حتى لا يُحفظ مرتين.
+    كل دفعة تُدرج بـ executemany داخل معاملة واحدة.
+    """
+
+    def __init__(self, db_path, table_name, messages=None):
+        self.db_path = db_path
+        self.table_name = table_name
+        self.inputs_table = 'prediction_inputs'
+        self.messages_table = 'fault_messages'
+        self.uploads_table = 'prediction_uploads'
+        # {رمز العطل: (الاسم، الرسالة)}
+        self.messages = messages or {}
+        self._conn = None
+        self._input_columns = None
+        self._lock = threading.Lock()
+        self._readers = threading.local()
+        self._reader_conns = []
+
+    def _connect(self):
+        if self._conn is None:
+            # الاتصال مشترك بين خيوط مجموعة التنبؤ، والقفل يضمن كاتبًا واحدًا في كل مرة
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            for pragma in PRAGMAS:
+                self._conn.execute(pragma)
+            self._ensure_schema(self._conn)
+        return self._conn
+
+    def _table_info(self, conn, table):
+        return conn.execute(f"PRAGMA table_info({_quote(table)})").fetchall()
+
+    def _ensure_schema(self, conn):
+        with conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {_quote(self.messages_table)} "
+                "(code INTEGER PRIMARY KEY, label TEXT NOT NULL, message TEXT NOT NULL)"
+            )
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {_quote(self.messages_table)} (code, label, message) VALUES (?, ?, ?)",
+                [(int(code), label, message) for code, (label, message) in self.messages.items()]
+            )
+
+        columns = [row[1] for row in self._table_info(conn, self.table_name)]
+        legacy = bool(columns) and any(col in columns for col in LEGACY_RESULT_COLUMNS)
+        if legacy:
+            self._migrate_legacy(conn, columns)
+        with conn:
+            self._create_predictions_table(conn)
+            self._create_indexes(conn)
+            self._create_uploads_table(conn)
+
+    def _create_predictions_table(self, conn):
+        # بدون commit هنا: تعمل داخل معاملة المستدعي (ومنها معاملة الترحيل)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {_quote(self.table_name)} ("
+            "id INTEGER PRIMARY KEY, "
+            "predicted_at REAL NOT NULL, "
+            "recorded_at TEXT, "
+            "vehicle_id TEXT, "
+            "fault_code INTEGER NOT NULL, "
+            "confidence REAL, "
+            "probabilities BLOB)"
+        )
+
+    def _create_indexes(self, conn):
+        # فهارس الاستعلامات: نطاق زمني، ونطاق زمني لمركبة واحدة أو لعطل واحد
+        table = _quote(self.table_name)
+        for name, columns in (
+            ('predicted_at', 'predicted_at'),
+            ('vehicle_time', 'vehicle_id, predicted_at'),
+            ('fault_time', 'fault_code, predicted_at'),
+        ):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {_quote(f'idx_{self.table_name}_{name}')} ON {table} ({columns})")
+
+    def _create_uploads_table(self, conn):
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {_quote(self.uploads_table)} ("
+            "digest TEXT NOT NULL, "
+            "model_version TEXT NOT NULL, "
+            "tier TEXT NOT NULL, "
+            "first_id INTEGER NOT NULL, "
+            "rows INTEGER NOT NULL, "
+            "uploaded_at REAL NOT NULL, "
+            "PRIMARY KEY (digest, model_version, tier)) WITHOUT ROWID"
+        )
+
+    def _claim_upload(self, conn, batch, first_id):
+        # تسجيل بصمة الملف داخل معاملة الحفظ نفسها؛ إذا كانت مسجلة من قبل فالدفعة مكررة ولا تُحفظ
+        if batch.upload is None:
+            return True
+        cursor = conn.execute(
+            f"INSERT OR IGNORE INTO {_quote(self.uploads_table)} "
+            "(digest, model_version, tier, first_id, rows, uploaded_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (*batch.upload, first_id, len(batch), batch.predicted_at)
+        )
+        return cursor.rowcount > 0
+
+    def _create_inputs_table(self, conn, definitions):
+        columns = ", ".join(f"{_quote(col)} {sql_type}" for col, sql_type in definitions)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {_quote(self.inputs_table)} "
+            f"(prediction_id INTEGER PRIMARY KEY, {columns})"
+        )
+
+    def _migrate_legacy(self, conn, columns):
+        """
+        ترحيل جدول to_sql القديم (كل أعمدة البيانات + اسم العطل + الرسالة العربية) إلى المخطط المضغوط.
+        رقم الصف القديم يصبح رقم التنبؤ، والقراءات تُنقل إلى prediction_inputs، ثم يُحذف الجدول القديم.
+        """
+        print(f"جاري ترحيل الجدول {self.table_name} إلى المخطط المضغوط...")
+        legacy = f"{self.table_name}_legacy"
+        types = {row[1]: row[2] or "TEXT" for row in self._table_info(conn, self.table_name)}
+        input_columns = [
+            col for col in columns if col not in LEGACY_RESULT_COLUMNS + (TIMESTAMP_COLUMN, VEHICLE_COLUMN)
+        ]
+
+        def legacy_column(col):
+            return f"l.{_quote(col)}" if col in columns else "NULL"
+
+        with conn:
+            # كل خطوات الترحيل في معاملة واحدة: أي فشل يُبقي الجدول القديم كما هو
+            conn.execute("BEGIN")
+            conn.execute(f"ALTER TABLE {_quote(self.table_name)} RENAME TO {_quote(legacy)}")
+            self._create_predictions_table(conn)
+            # الصفوف القديمة بلا وقت تنبؤ: يُستخدم وقت القراءة إن وُجد
+            conn.execute(
+                f"INSERT INTO {_quote(self.table_name)} (id, predicted_at, recorded_at, vehicle_id, fault_code) "
+                f"SELECT l.rowid, COALESCE(CAST(strftime('%s', {legacy_column(TIMESTAMP_COLUMN)}) AS REAL), 0), "
+                f"{legacy_column(TIMESTAMP_COLUMN)}, {legacy_column(VEHICLE_COLUMN)}, COALESCE(m.code, -1) "
+                f"FROM {_quote(legacy)} l LEFT JOIN {_quote(self.messages_table)} m "
+                f"ON m.label = {legacy_column('Predicted_Fault')}"
+            )
+            if input_columns:
+                self._create_inputs_table(conn, [(col, types[col]) for col in input_columns])
+                selected = ", ".join(f"l.{_quote(col)}" for col in input_columns)
+                conn.execute(
+                    f"INSERT INTO {_quote(self.inputs_table)} (prediction_id, {', '.join(map(_quote, input_columns))}) "
+                    f"SELECT l.rowid, {selected} FROM {_quote(legacy)} l"
+                )
+            conn.execute(f"DROP TABLE {_quote(legacy)}")
+        # استرجاع المساحة التي كان يشغلها الجدول القديم
+        conn.execute("VACUUM")
+        print("تم ترحيل الجدول بنجاح.")
+
+    def _inputs_schema(self, conn, input_schema):
+        # أعمدة جدول المدخلات من أعمدة النموذج وأنواعها، لا من أعمدة أول دفعة: الجدول يُنشأ بكل الأعمدة،
+        # والأعمدة الناقصة في جدول موجود (مثل جدول مُرحّل أو نموذج جديد) تُضاف إليه
+        if self._input_columns is None:
+            rows = self._table_info(conn, self.inputs_table)
+            if not rows:
+                self._create_inputs_table(conn, [(col, _sql_type(dtype)) for col, dtype in input_schema.items()])
+                rows = self._table_info(conn, self.inputs_table)
+            self._input_columns = [row[1] for row in rows if row[1] != 'prediction_id']
+        for col, dtype in input_schema.items():
+            if col not in self._input_columns:
+                conn.execute(f"ALTER TABLE {_quote(self.inputs_table)} ADD COLUMN {_quote(col)} {_sql_type(dtype)}")
+                self._input_columns.append(col)
+        return list(input_schema)
+
+    @staticmethod
+    def _optional_column(data, col):
+        if col in data.columns:
+            return _column_values(data[col])
+        return [None] * len(data)
+
+    def _insert(self, conn, batch, first_id):
+        n = len(batch)
+        ids = range(first_id, first_id + n)
+        confidence = probabilities = [None] * n
+        if batch.probabilities is not None:
+            probs = np.asarray(batch.probabilities, dtype=np.float32)
+            confidence = probs.max(axis=1).tolist()
+            if batch.store_probabilities:
+                # الاحتمالات تُحفظ كمصفوفة float32 مضغوطة (4 بايت لكل فئة)
+                probabilities = [row.tobytes() for row in probs]
+
+        conn.executemany(
+            f"INSERT INTO {_quote(self.table_name)} "
+            "(id, predicted_at, recorded_at, vehicle_id, fault_code, confidence, probabilities) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            zip(
+                ids, [batch.predicted_at] * n,
+                self._optional_column(batch.data, TIMESTAMP_COLUMN), self._optional_column(batch.data, VEHICLE_COLUMN),
+                batch.fault_codes.tolist(), confidence, probabilities
+            )
+        )
+
+        if batch.input_schema:
+            columns = self._inputs_schema(conn, batch.input_schema)
+            placeholders = ", ".join("?" * (len(columns) + 1))
+            conn.executemany(
+                f"INSERT INTO {_quote(self.inputs_table)} (prediction_id, {', '.join(map(_quote, columns))}) "
+                f"VALUES ({placeholders})",
+                zip(ids, *[self._optional_column(batch.data, col) for col in columns])
+            )
+
+    def write(self, batch):
+        """
+        حفظ دفعة واحدة في معاملة واحدة. أعمدة المدخلات الناقصة في الدفعة تُحفظ NULL.
+        """
+        return self.write_many([batch])
+
+    def write_many(self, batches):
+        """
+        حفظ عدة دفعات (من طلبات مختلفة) في معاملة واحدة.
+        الدفعات من ملفات حُفظت نتائجها من قبل (نفس upload) تُتجاهل. تُعيد عدد الصفوف المحفوظة.
+        """
+        batches = [batch for batch in batches if len(batch)]
+        if not batches:
+            return 0
+        written = 0
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                # BEGIN IMMEDIATE يأخذ قفل الكتابة قبل قراءة MAX(id)، فلا تحجز عمليتان (عدة عمّال uvicorn)
+                # نفس أرقام التنبؤات التي تُحجز مسبقًا لربط المدخلات بها
+                conn.execute("BEGIN IMMEDIATE")
+                next_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {_quote(self.table_name)}").fetchone()[0]
+                for batch in batches:
+                    if not self._claim_upload(conn, batch, next_id):
+                        continue
+                    self._insert(conn, batch, next_id)
+                    next_id += len(batch)
+                    written += len(batch)
+        return written
+
+    def _reader(self):
+        # اتصال قراءة فقط لكل خيط؛ وضع WAL يسمح بالقراءة أثناء الكتابة دون انتظار القفل
+        conn = getattr(self._readers, 'conn', None)
+        if conn is None:
+            self.migrate()
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._readers.conn = conn
+            with self._lock:
+                self._reader_conns.append(conn)
+        return conn
+
+    @staticmethod
+    def _filters(start=None, end=None, vehicle_id=None, fault_code=None):
+        # شروط WHERE تستخدم الفهارس: predicted_at، و (vehicle_id، predicted_at)، و (fault_code، predicted_at)
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("f.predicted_at >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("f.predicted_at < ?")
+            params.append(end)
+        if vehicle_id is not None:
+            clauses.append("f.vehicle_id = ?")
+            params.append(vehicle_id)
+        if fault_code is not None:
+            clauses.append("f.fault_code = ?")
+            params.append(fault_code)
+        return clauses, params
+
+    def query(self, start=None, end=None, vehicle_id=None, fault_code=None, limit=100, before_id=None):
+        """
+        التنبؤات المحفوظة من الأحدث إلى الأقدم، صفحة واحدة في كل مرة.
+        الصفحة التالية تبدأ من before_id (رقم آخر صف في الصفحة الحالية) بدلاً من OFFSET.
+        الترتيب (predicted_at، id) هو ترتيب الفهارس نفسها (كل فهرس ينتهي بـ rowid)، فتُقرأ الصفحة مباشرة
+        من الفهرس دون فرز كل الصفوف المطابقة، ويضيّق before_id نطاق الفهرس.
+        """
+        clauses, params = self._filters(start, end, vehicle_id, fault_code)
+        if before_id is not None:
+            clauses.append(
+                f"(f.predicted_at, f.id) < (SELECT predicted_at, id FROM {_quote(self.table_name)} WHERE id = ?)"
+            )
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        cursor = self._reader().execute(
+            "SELECT f.id, f.predicted_at, f.recorded_at, f.vehicle_id, f.fault_code, m.label, f.confidence "
+            f"FROM {_quote(self.table_name)} f LEFT JOIN {_quote(self.messages_table)} m ON m.code = f.fault_code "
+            f"{where} ORDER BY f.predicted_at DESC, f.id DESC LIMIT ?",
+            params + [limit]
+        )
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def class_counts(self, start=None, end=None, vehicle_id=None):
+        """
+        عدد التنبؤات لكل عطل، محسوب داخل SQLite.
+        """
+        clauses, params = self._filters(start, end, vehicle_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT f.fault_code, m.label, COUNT(*) FROM {_quote(self.table_name)} f "
+            f"LEFT JOIN {_quote(self.messages_table)} m ON m.code = f.fault_code "
+            f"{where} GROUP BY f.fault_code ORDER BY f.fault_code",
+            params
+        ).fetchall()
+        return [{"fault_code": code, "label": label, "count": count} for code, label, count in rows]
+
+    def migrate(self):
+        """
+        فتح قاعدة البيانات وترحيل الجدول القديم إن وُجد.
+        """
+        with self._lock:
+            self._connect()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._input_columns = None
+            for conn in self._reader_conns:
+                conn.close()
+            self._reader_conns = []
+            self._readers = threading.local()
+
+
+class WriteBehindQueue:
+    """
+    حفظ النتائج في الخلفية: الطلبات تضيف دفعاتها إلى طابور محدود في الذاكرة وتعود فورًا،
+    وخيط واحد يجمع الدفعات من عدة طلبات ويكتبها معًا عند بلوغ flush_rows صف أو مرور flush_interval ثانية.
+    عند امتلاء الطابور (max_rows صف) تُسقط الدفعة الجديدة وتُحسب في dropped_rows بدلاً من إبطاء الطلبات.
+    """
+
+    def __init__(self, store, max_rows=200000, flush_rows=5000, flush_interval=1.0):
+        self.store = store
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._batches = deque()
+        self._queued_rows = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._written_rows = 0
+        self._dropped_rows = 0
+        self._flushes = 0
+        self._errors = 0
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='prediction-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        إيقاف الخيط بعد كتابة كل ما تبقى في الطابور.
+        """
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+
+    def put(self, batch):
+        """
+        إضافة دفعة إلى الطابور دون انتظار الكتابة؛ يجب ألا تُعدّل الدفعة بعد إضافتها.
+        تُعيد False إذا أُسقطت الدفعة لامتلاء الطابور.
+        """
+        with self._cond:
+            if self._queued_rows + len(batch) > self.max_rows:
+                self._dropped_rows += len(batch)
+                return False
+            self._batches.append(batch)
+            self._queued_rows += len(batch)
+            if self._queued_rows >= self.flush_rows:
+                self._cond.notify()
+        return True
+
+    def _take(self):
+        # انتظار بلوغ حجم الكتابة أو انتهاء المهلة، ثم أخذ كل ما في الطابور
+        deadline = time.monotonic() + self.flush_interval
+        with self._cond:
+            while not self._stopping and self._queued_rows < self.flush_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batches = list(self._batches)
+            self._batches.clear()
+            self._queued_rows = 0
+            return batches, self._stopping
+
+    def _run(self):
+        while True:
+            batches, stopping = self._take()
+            if batches:
+                try:
+                    written = self.store.write_many(batches)
+                    with self._cond:
+                        self._written_rows += written
+                        self._flushes += 1
+                except Exception as e:
+                    print(f"فشل حفظ النتائج في قاعدة البيانات: {str(e)}")
+                    with self._cond:
+                        self._errors += 1
+                        self._dropped_rows += sum(len(batch) for batch in batches)
+            if stopping:
+                return
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued_rows": self._queued_rows,
+                "queued_batches": len(self._batches),
+                "written_rows": self._written_rows,
+                "dropped_rows": self._dropped_rows,
+                "flushes": self._flushes,
+                "errors": self._errors,
+            }
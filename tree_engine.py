@@ -0,0 +1,166 @@
+import json
+
+import numpy as np
+
+
+class CompiledForest:
+    """
+    محرك استدلال بديل يقرأ car_fault_classifier.json إلى مصفوفات مسطحة
+    ويقيّم كل الأشجار لدفعة كاملة من الصفوف باستخدام NumPy فقط، دون الحاجة إلى xgboost.
+    """
+
+    # عدد الصفوف التي تُقيَّم معًا للحد من استهلاك الذاكرة في الملفات الكبيرة
+    chunk_size = 65536
+
+    def __init__(self, model_path):
+        with open(model_path, 'r', encoding='utf-8') as f:
+            learner = json.load(f)['learner']
+
+        model_param = learner['learner_model_param']
+        self.n_classes = max(int(model_param.get('num_class', '0')), 1)
+        self.n_features = int(model_param['num_feature'])
+        self.feature_names = learner.get('feature_names') or None
+        self.objective = learner['objective']['name']
+        self.base_score = self._parse_base_score(model_param['base_score'])
+
+        attributes = learner.get('attributes', {})
+        self.best_iteration = int(attributes['best_iteration']) if 'best_iteration' in attributes else None
+
+        booster = learner['gradient_booster']
+        if booster['name'] != 'gbtree':
+            raise ValueError(f"نوع الـ booster غير مدعوم: {booster['name']}")
+        forest = booster['model']
+        trees = forest['trees']
+        self.iteration_indptr = np.asarray(forest['iteration_indptr'], dtype=np.int64)
+        self.n_rounds = len(self.iteration_indptr) - 1
+        self.tree_class = np.asarray(forest['tree_info'], dtype=np.int64)
+
+        if any(np.any(np.asarray(t['split_type']) != 0) for t in trees):
+            raise ValueError("التقسيمات الفئوية غير مدعومة في هذا المحرك")
+
+        # دمج عقد كل الأشجار في مصفوفات واحدة، مع ترقيم الابن الأيمن دائمًا بعد الأيسر مباشرة
+        # حتى يكفي في كل خطوة: العقدة التالية = الابن الأيسر + (0 أو 1)
+        left, split_feature, split_conditions, default_left, is_leaf, roots = [], [], [], [], [], []
+        offset = 0
+        for tree in trees:
+            order = self._pair_children_order(tree)
+            new_id = np.empty(len(order), dtype=np.int64)
+            new_id[order] = np.arange(len(order))
+            tree_left = np.asarray(tree['left_children'], dtype=np.int64)[order]
+            tree_is_leaf = tree_left == -1
+            tree_nodes = np.arange(len(order))
+            left.append(np.where(tree_is_leaf, tree_nodes, new_id[tree_left]) + offset)
+            split_feature.append(np.asarray(tree['split_indices'], dtype=np.int32)[order])
+            split_conditions.append(np.asarray(tree['split_conditions'], dtype=np.float32)[order])
+            default_left.append(np.asarray(tree['default_left'], dtype=bool)[order])
+            is_leaf.append(tree_is_leaf)
+            roots.append(offset)
+            offset += len(order)
+
+        is_leaf = np.concatenate(is_leaf)
+        split_conditions = np.concatenate(split_conditions)
+        self.tree_roots = np.asarray(roots, dtype=np.intp)
+        # الأوراق تشير إلى نفسها وعتبتها NaN فلا تتجه يمينًا أبدًا، فتبقى ثابتة خلال التكرارات
+        self.left = np.concatenate(left).astype(np.intp)
+        self.split_feature = np.where(is_leaf, 0, np.concatenate(split_feature)).astype(np.intp)
+        # قيمة التقسيم للعقد الداخلية وقيمة الورقة للأوراق (بدقة float32 كما في xgboost)
+        self.threshold = np.where(is_leaf, np.float32(np.nan), split_conditions).astype(np.float32)
+        self.leaf_value = np.where(is_leaf, split_conditions, np.float32(0)).astype(np.float32)
+        self.default_right = ~(np.concatenate(default_left) | is_leaf)
+        self.max_depth = self._max_depth(trees)
+
+    @staticmethod
+    def _pair_children_order(tree):
+        # ترتيب العقد بحيث يأتي كل ابن أيمن بعد أخيه الأيسر مباشرة
+        order = [0]
+        for node in order:
+            if tree['left_children'][node] != -1:
+                order.append(tree['left_children'][node])
+                order.append(tree['right_children'][node])
+        return np.asarray(order, dtype=np.int64)
+
+    @staticmethod
+    def _parse_base_score(value):
+        # قد تُحفظ كقيمة واحدة أو كمصفوفة بحسب إصدار xgboost
+        value = value.strip()
+        if value.startswith('['):
+            return np.asarray(json.loads(value), dtype=np.float32)
+        return np.float32(float(value))
+
+    @staticmethod
+    def _max_depth(trees):
+        deepest = 0
+        for tree in trees:
+            depth = {0: 0}
+            for node, (l, r) in enumerate(zip(tree['left_children'], tree['right_children'])):
+                if l != -1:
+                    depth[l] = depth[r] = depth[node] + 1
+                    deepest = max(deepest, depth[l])
+        return deepest
+
+    def _resolve_iteration_range(self, iteration_range):
+        # نفس سلوك XGBClassifier.predict: التوقف عند best_iteration إن وُجد
+        if iteration_range is None or iteration_range[1] is None or iteration_range[1] == 0:
+            begin = 0 if iteration_range is None else iteration_range[0]
+            end = self.best_iteration + 1 if self.best_iteration is not None else self.n_rounds
+        else:
+            begin, end = iteration_range
+        if not 0 <= begin < end <= self.n_rounds:
+            raise ValueError(f"نطاق التكرارات غير صالح: ({begin}, {end})")
+        return begin, end
+
+    def _as_matrix(self, X):
+        if hasattr(X, 'columns') and self.feature_names is not None:
+            X = X[self.feature_names]
+        X = np.ascontiguousarray(np.asarray(X, dtype=np.float32))
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"عدد الخصائص المتوقع {self.n_features}، والمستلم {X.shape}")
+        return X
+
+    def _leaf_margins(self, X, trees):
+        # كل صف يمر على كل الأشجار معًا: مصفوفة عقد بحجم (الصفوف × الأشجار) تتقدم مستوى واحدًا في كل خطوة
+        flat = X.ravel()
+        row_start = (np.arange(len(X), dtype=np.intp) * X.shape[1])[:, None]
+        nodes = np.broadcast_to(self.tree_roots[trees], (len(X), len(trees))).copy()
+        for _ in range(self.max_depth):
+            values = np.take(flat, row_start + np.take(self.split_feature, nodes))
+            # القيم المفقودة (NaN) تفشل في المقارنة وتتبع الاتجاه الافتراضي للعقدة
+            go_right = values >= np.take(self.threshold, nodes)
+            go_right |= np.isnan(values) & np.take(self.default_right, nodes)
+            nodes = np.take(self.left, nodes) + go_right
+        return np.take(self.leaf_value, nodes)
+
+    def predict_margin(self, X, iteration_range=None):
+        """
+        إرجاع الهوامش الخام لكل فئة (مكافئ output_margin=True).
+        """
+        X = self._as_matrix(X)
+        begin, end = self._resolve_iteration_range(iteration_range)
+        trees = np.arange(self.iteration_indptr[begin], self.iteration_indptr[end])
+        tree_class = self.tree_class[trees]
+
+        n_rounds = len(trees) // self.n_classes
+        if not np.array_equal(tree_class, np.tile(np.arange(self.n_classes), n_rounds)):
+            raise ValueError("ترتيب الأشجار حسب الفئات غير مدعوم")
+
+        margins = np.empty((len(X), self.n_classes), dtype=np.float32)
+        for start in range(0, len(X), self.chunk_size):
+            leaves = self._leaf_margins(X[start:start + self.chunk_size], trees)
+            leaves = leaves.reshape(len(leaves), n_rounds, self.n_classes)
+            # الجمع التراكمي بالترتيب وبدقة float32 (بدءًا من base_score) للحصول على نفس نتائج xgboost
+            stacked = np.empty((len(leaves), n_rounds + 1, self.n_classes), dtype=np.float32)
+            stacked[:, 0] = self.base_score
+            stacked[:, 1:] = leaves
+            margins[start:start + len(leaves)] = np.add.accumulate(stacked, axis=1)[:, -1]
+        return margins
+
+    def predict_proba(self, X, iteration_range=None):
+        margins = self.predict_margin(X, iteration_range=iteration_range)
+        shifted = np.exp(margins - margins.max(axis=1, keepdims=True))
+        return shifted / shifted.sum(axis=1, keepdims=True)
+
+    def predict(self, X, iteration_range=None):
+        margins = self.predict_margin(X, iteration_range=iteration_range)
+        if self.n_classes == 1:
+            return (margins[:, 0] > 0).astype(np.int32)
+        return np.argmax(margins, axis=1).astype(np.int32)
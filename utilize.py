@@ -3,11 +3,20 @@ import numpy as np
 from sklearn.preprocessing import LabelEncoder, OneHotEncoder
 import joblib
 
-def fill_missing(data, strategy_numeric='auto', save_indicators=False):
+NUMERIC_FILL_DTYPES = ['float64', 'float32', 'int64', 'bool']
+
+def fill_missing(data, strategy_numeric='auto', save_indicators=False, batched=True):
     """
     ملء القيم المفقودة في البيانات مع إضافة أعمدة تشير إلى القيم المفقودة (اختياري).
-
+    في الوضع batched تُحسب كل قيم الملء دفعة واحدة وتُطبق بـ fillna واحد، بنفس نتائج المعالجة عمودًا بعمود.
     """
+    if batched:
+        try:
+            return _fill_missing_batched(data, strategy_numeric, save_indicators)
+        except (TypeError, ValueError) as e:
+            # مثلاً عمود category لا يقبل القيمة الافتراضية؛ المعالجة عمودًا بعمود تتخطى العمود المعني فقط
+            print(f"تعذر ملء القيم دفعة واحدة، سيتم الملء عمودًا بعمود: {str(e)}")
+
     for col in data.columns:
         if data[col].isnull().sum() == 0:
             continue
@@ -18,7 +27,7 @@ def fill_missing(data, strategy_numeric='auto', save_indicators=False):
                 data[f'is_missing_{col}'] = data[col].isnull().astype(int)
 
             # معالجة الأعمدة الرقمية
-            if data[col].dtype in ['float64', 'int64', 'bool']:
+            if data[col].dtype in NUMERIC_FILL_DTYPES:
                 if strategy_numeric == 'auto':
                     # اختيار median إذا كان التوزيع منحرفًا
                     skew_value = data[col].skew()
@@ -47,6 +56,77 @@ def fill_missing(data, strategy_numeric='auto', save_indicators=False):
 
     return data
 
+def compute_fill_values(data, columns, strategy_numeric='auto'):
+    """
+    حساب قيمة الملء لكل عمود بنفس قواعد fill_missing (mean/median للأعمدة الرقمية و mode للفئوية).
+    """
+    if strategy_numeric not in ('auto', 'median', 'mean'):
+        raise ValueError("strategy_numeric must be 'mean', 'median', or 'auto'")
+
+    numeric_cols = [col for col in columns if data[col].dtype in NUMERIC_FILL_DTYPES]
+    other_cols = [col for col in columns if col not in numeric_cols]
+    fill_values = {}
+
+    # الأعمدة الرقمية: حساب الإحصائيات لكل الأعمدة معًا
+    if numeric_cols:
+        numeric = data[numeric_cols]
+        if strategy_numeric == 'median':
+            numeric_fill = numeric.median()
+        elif strategy_numeric == 'mean':
+            numeric_fill = numeric.mean()
+        else:
+            # اختيار median إذا كان التوزيع منحرفًا، مع حساب الإحصائية المطلوبة فقط لكل عمود
+            skewed = numeric.skew() > 1
+            numeric_fill = pd.Series(np.nan, index=numeric.columns)
+            if skewed.any():
+                numeric_fill[skewed] = numeric.loc[:, skewed].median()
+            if not skewed.all():
+                numeric_fill[~skewed] = numeric.loc[:, ~skewed].mean()
+        fill_values.update(numeric_fill.to_dict())
+
+    # الأعمدة الفئوية: القيمة الأكثر تكرارًا أو 'Unknown' إذا لم توجد
+    if other_cols:
+        modes = data[other_cols].mode()
+        for col in other_cols:
+            mode_val = modes[col].iloc[0] if len(modes) else np.nan
+            fill_values[col] = mode_val if pd.notna(mode_val) else 'Unknown'
+
+    return fill_values
+
+def _fill_missing_batched(data, strategy_numeric, save_indicators):
+    if strategy_numeric not in ('auto', 'median', 'mean'):
+        raise ValueError("strategy_numeric must be 'mean', 'median', or 'auto'")
+
+    # مرور واحد لتحديد كل الأعمدة التي تحتوي على قيم مفقودة
+    missing = data.isna()
+    missing_counts = missing.sum()
+    missing_cols = list(missing_counts.index[missing_counts > 0])
+    if not missing_cols:
+        return data
+
+    fill_values = compute_fill_values(data, missing_cols, strategy_numeric)
+
+    if save_indicators:
+        indicators = missing[missing_cols].astype(int)
+        indicators.columns = [f'is_missing_{col}' for col in missing_cols]
+        data[list(indicators.columns)] = indicators
+
+    data.fillna(value=fill_values, inplace=True)
+    return data
+
+def fit_imputer(data, strategy_numeric='auto', imputer_path='imputer.pkl'):
+    """
+    حساب قيم الملء من بيانات التدريب لكل الأعمدة وحفظها بجانب encoders.pkl،
+    حتى لا يعتمد ملء القيم وقت التنبؤ على إحصائيات الدفعة المرفوعة.
+    """
+    fill_values = compute_fill_values(data, list(data.columns), strategy_numeric)
+    # الأعمدة التي ليس لها قيمة (رقمية فارغة بالكامل) لا فائدة من حفظها
+    fill_values = {col: val for col, val in fill_values.items() if pd.notna(val)}
+    if imputer_path:
+        joblib.dump(fill_values, imputer_path)
+        print(f"تم حفظ قيم الملء باسم '{imputer_path}'")
+    return fill_values
+
 def encode_categorical_columns(data, encoders_path=None):
     """
     ترميز الأعمدة الفئوية باستخدام LabelEncoder للأعمدة الثنائية وOneHotEncoder للأعمدة متعددة القيم.